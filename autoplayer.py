@@ -0,0 +1,221 @@
+# plays tetris by itself. For every new piece it finds every placement the piece can reach, and scores all of them at once with numpy
+# run with: python autoplayer.py [--games N] [--pieces N]
+import argparse
+import time
+
+import numpy as np
+
+from engine import Game, no_of_rows, no_of_cols, shapes, left, right, down, rotate
+
+# how much each feature of the board after a placement counts towards its score
+height_weight = -0.510066 # total height of all columns
+lines_weight = 0.760666 # lines cleared by the placement
+holes_weight = -0.35663 # empty squares with a filled square above them
+bumpiness_weight = -0.184483 # differences in height between neighbouring columns
+
+
+class PieceTable: # the squares of one tetris piece in every rotation state, as numpy arrays
+    def __init__(self, piece):
+        self.rows = np.array([[square[0] for square in squares] for squares in piece.rotations]) # row offset of each square, shape (4 rotation states, 4 squares)
+        self.cols = np.array([[square[1] for square in squares] for squares in piece.rotations]) # column offset of each square
+        # lowest square in each column of the piece, padded to 4 entries by repeating the first one
+        bottoms = [list(bottom) + [bottom[0]] * (4 - len(bottom)) for bottom in piece.bottoms]
+        self.bottom_cols = np.array([[bottom[0] for bottom in state] for state in bottoms])
+        self.bottom_rows = np.array([[bottom[1] for bottom in state] for state in bottoms])
+        # for checking whether the piece fits: the first and last column offset of each rotation state, and (row offset, bitmask of its squares in that row) pairs
+        # the bitmasks start at the piece's first column, so they never have to be shifted by a negative amount
+        self.col_ranges = []
+        self.masks = []
+        for squares in piece.rotations:
+            first_col = min(square[1] for square in squares)
+            masks = {}
+            for square in squares:
+                masks[square[0]] = masks.get(square[0], 0) | 1 << (square[1] - first_col)
+            self.col_ranges.append((first_col, max(square[1] for square in squares)))
+            self.masks.append(tuple(masks.items()))
+
+piece_tables = {piece: PieceTable(piece) for piece in shapes} # built once for every piece
+piece_numbers = {piece: number for number, piece in enumerate(shapes)}
+# the tables of all pieces stacked together, shape (7 pieces, 4 rotation states, 4 squares), so that placements of different pieces can be looked up at once
+all_rows = np.array([piece_tables[piece].rows for piece in shapes])
+all_cols = np.array([piece_tables[piece].cols for piece in shapes])
+all_bottom_cols = np.array([piece_tables[piece].bottom_cols for piece in shapes])
+all_bottom_rows = np.array([piece_tables[piece].bottom_rows for piece in shapes])
+col_bits = np.arange(no_of_cols) # bit of each column in a row mask
+
+
+# check whether a piece fits on a board in the given rotation state with the top-left corner of its box at row, col
+# the same check as Board.fits, but done one row mask at a time
+def fits(board_rows, table, rotation_pos, row, col):
+    col_range = table.col_ranges[rotation_pos]
+    first_col = col + col_range[0]
+    if first_col < 0 or col + col_range[1] >= no_of_cols:
+        return False
+    for row_offset, mask in table.masks[rotation_pos]:
+        square_row = row + row_offset
+        if square_row >= no_of_rows:
+            return False
+        if square_row >= 0 and board_rows[square_row] & mask << first_col:
+            return False
+    return True
+
+# every (rotation state, row, column) the falling piece of a game can be dropped from
+# the piece is turned with the same wall kicks as the game uses, then slid left and right from each rotation state until it hits something
+# the row is part of the placement, as a kick can move the piece up or down, and the piece only fits at the row the kick moved it to
+def reachable_placements(game):
+    board_rows = game.board.rows
+    piece = game.piece
+    table = piece_tables[piece]
+    row = game.piece_pos[0]
+    col = game.piece_pos[1]
+    rotation_pos = game.rotation_pos
+    placements = []
+    seen = set() # the O piece looks the same in every rotation state, so the same squares can come up more than once
+    for turn in range(4):
+        for step in (0, -1, 1):
+            slide_col = col + step
+            while fits(board_rows, table, rotation_pos, row, slide_col):
+                key = (piece.rotations[rotation_pos], row, slide_col)
+                if key not in seen:
+                    seen.add(key)
+                    placements.append((rotation_pos, row, slide_col))
+                if step == 0:
+                    break
+                slide_col += step
+
+        # turn the piece once more, using the first wall kick that fits
+        new_rotation_pos = (rotation_pos + 1) % 4
+        for kick in piece.wall_kicks[rotation_pos]:
+            if fits(board_rows, table, new_rotation_pos, row + kick[0], col + kick[1]):
+                row += kick[0]
+                col += kick[1]
+                rotation_pos = new_rotation_pos
+                break
+        else:
+            break # piece can't turn any further
+    return placements
+
+# turn the row masks of a board into a (rows, columns) array of booleans
+def board_to_array(board):
+    return (np.array(board.rows)[:, None] >> col_bits & 1).astype(bool)
+
+# choose the best placement for the falling piece of every game. All placements of all games are scored in one numpy pass
+# returns a (rotation state, row, column) placement for each game, or None if its piece can't be placed
+def best_placements(games):
+    cand_games = [] # game each placement belongs to
+    cand_rotations = []
+    cand_rows = [] # row the piece is dropped from
+    cand_cols = []
+    for index, game in enumerate(games):
+        for rotation_pos, row, col in reachable_placements(game):
+            cand_games.append(index)
+            cand_rotations.append(rotation_pos)
+            cand_rows.append(row)
+            cand_cols.append(col)
+    best = [None] * len(games)
+    if not cand_games:
+        return best
+
+    cand_games = np.array(cand_games)
+    cand_rotations = np.array(cand_rotations)
+    cand_cols = np.array(cand_cols)[:, None]
+    no_of_cands = len(cand_games)
+
+    # look up the squares of each placement's piece
+    cand_pieces = np.array([piece_numbers[game.piece] for game in games])[cand_games]
+    rows = all_rows[cand_pieces, cand_rotations]
+    cols = all_cols[cand_pieces, cand_rotations]
+    bottom_cols = all_bottom_cols[cand_pieces, cand_rotations]
+    bottom_rows = all_bottom_rows[cand_pieces, cand_rotations]
+
+    # drop every placement: the piece lands where its lowest squares meet the column heights
+    heights = np.array([game.board.heights for game in games])
+    landing = (heights[cand_games[:, None], bottom_cols + cand_cols] - 1 - bottom_rows).min(axis=1)
+    square_rows = rows + landing[:, None]
+    square_cols = cols + cand_cols
+    above_top = (square_rows < 0).any(axis=1) # squares above the board would be lost, which ends the game
+
+    # the board of every placement after the piece has landed
+    boards = np.array([board_to_array(game.board) for game in games])[cand_games]
+    boards[np.arange(no_of_cands)[:, None], np.maximum(square_rows, 0), square_cols] = True
+
+    # work out the features of each board as if its full rows were already removed
+    full = boards.all(axis=2)
+    lines = full.sum(axis=1)
+    kept = boards & ~full[:, :, None]
+    covered = np.logical_or.accumulate(kept, axis=1) # squares at or below the top of their column
+    holes = (covered & ~boards).sum(axis=(1, 2))
+    col_heights = (covered & ~full[:, :, None]).sum(axis=1)
+    aggregate_height = col_heights.sum(axis=1)
+    bumpiness = np.abs(np.diff(col_heights, axis=1)).sum(axis=1)
+
+    scores = height_weight * aggregate_height + lines_weight * lines + holes_weight * holes + bumpiness_weight * bumpiness
+    scores[above_top] = -np.inf
+
+    # best placement of each game
+    order = np.lexsort((-scores, cand_games)) # grouped by game, best score first
+    first = np.ones(no_of_cands, dtype=bool)
+    first[1:] = cand_games[order][1:] != cand_games[order][:-1]
+    for cand in order[first]:
+        best[cand_games[cand]] = (int(cand_rotations[cand]), cand_rows[cand], int(cand_cols[cand, 0]))
+    return best
+
+# choose the best placement for the falling piece of one game
+def best_placement(game):
+    return best_placements([game])[0]
+
+
+class AutoPlayer: # presses the buttons of a game, one tick at a time, to move each piece to the placement chosen for it
+    def __init__(self):
+        self.piece_no = None # game.index of the piece the target was chosen for
+        self.target = None # (rotation state, row, column) to move the piece to. The row is reached by the wall kicks of the rotations
+
+    # the autoplayer keeps playing until the game is over
+    def finished(self):
+        return False
+
+    # press the button for the next tick of the game
+    def press(self, game):
+        if game.index != self.piece_no: # a new piece, so choose where it goes
+            self.piece_no = game.index
+            self.target = best_placement(game)
+        if self.target is None:
+            return
+        rotation_pos, row, col = self.target
+        if game.rotation_pos != rotation_pos:
+            game.push_input(rotate)
+        elif game.piece_pos[1] != col:
+            game.push_input(right if col > game.piece_pos[1] else left)
+        else:
+            game.push_input(down)
+
+
+# play many seeded games side by side without ticking: every piece is dropped straight into its chosen placement
+# the placements of all games that are still running are chosen together in one batch
+def play_games(seeds, max_pieces):
+    games = [Game(seed) for seed in seeds]
+    for game in games:
+        game.get_random_shape()
+    running = [game for game in games if not game.game_over]
+    while running:
+        for game, placement in zip(running, best_placements(running)):
+            if placement is None or game.drop_piece(*placement) is None:
+                game.game_over = True
+        running = [game for game in running if not game.game_over and game.index <= max_pieces]
+    return games
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Let the autoplayer play seeded games without discord.')
+    parser.add_argument('--games', type=int, default=20, help='number of games to play at once')
+    parser.add_argument('--pieces', type=int, default=500, help='stop each game after this many pieces')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the first game, the others count up from it')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    games = play_games(range(args.seed, args.seed + args.games), args.pieces)
+    elapsed = time.perf_counter() - start
+    placed = sum(game.index for game in games)
+    for game in games:
+        print('seed {:>6}  score {:>7}  lines {:>5}  pieces {:>5}'.format(game.seed, game.points, game.lines, game.index))
+    print('{} pieces placed in {:.2f}s ({:.0f} placements/sec)'.format(placed, elapsed, placed / elapsed))
@@ -0,0 +1,170 @@
+# benchmarks for the tetris engine. Every run plays the same seeded games, so results from different versions of the engine can be compared
+# run with: python bench.py [--games N] [--engine module] [--workload auto|random]
+import argparse
+import copy
+import importlib
+import random
+import sys
+import time
+import tracemalloc
+
+import headless
+from engine import tick
+
+
+# input logs (see Game.input_log) of games played by the autoplayer, which clear lines like real games do. Needs numpy
+# the pieces of every game that got a new piece on the same tick are placed together in one batch
+def autoplayer_logs(no_of_games, no_of_pieces):
+    import autoplayer
+    games = [autoplayer.Game(seed) for seed in range(no_of_games)]
+    players = [autoplayer.AutoPlayer() for game in games]
+    for game in games:
+        game.get_random_shape()
+    running = list(zip(games, players))
+    while running:
+        new_pieces = [(game, player) for game, player in running if game.index != player.piece_no]
+        for (game, player), placement in zip(new_pieces, autoplayer.best_placements([game for game, player in new_pieces])):
+            player.piece_no = game.index
+            player.target = placement
+        for game, player in running:
+            player.press(game)
+            game.advance()
+        running = [(game, player) for game, player in running if not game.game_over and game.index <= no_of_pieces]
+    return [(game.seed, ''.join(game.input_log)) for game in games]
+
+# input logs of the random scripts of headless.py. These games end after a few dozen pieces and hardly clear any lines
+def random_logs(no_of_games, no_of_pieces):
+    return [(seed, ''.join(tick if button == headless.no_button else button + tick for button in headless.random_script(seed, no_of_pieces)))
+            for seed in range(no_of_games)]
+
+# split an input log into the buttons pressed before each tick
+def log_ticks(input_log):
+    return input_log.split(tick)[:-1] # the log ends with a tick, which leaves an empty string at the end
+
+# play whole games and measure how fast ticks and line clears go
+def bench_games(game_class, logs):
+    logs = [(seed, log_ticks(input_log)) for seed, input_log in logs]
+    ticks = 0
+    lines = 0
+    start = time.perf_counter()
+    for seed, log in logs:
+        game = game_class(seed)
+        game.get_random_shape()
+        for buttons in log:
+            if game.game_over:
+                break
+            for button in buttons:
+                game.push_input(button)
+            game.advance()
+            ticks += 1
+        lines += game.lines
+    elapsed = time.perf_counter() - start
+    return ticks, lines, elapsed
+
+# collect copies of games at evenly spaced ticks of the logs, to call single engine functions on
+# at most about max_states are kept, as every function is called on two fresh copies of each of them
+def collect_states(game_class, logs, max_states=1000):
+    logs = [(seed, log_ticks(input_log)) for seed, input_log in logs]
+    every = max(1, sum(len(log) for seed, log in logs) // max_states)
+    states = []
+    ticks = 0
+    for seed, log in logs:
+        game = game_class(seed)
+        game.get_random_shape()
+        for buttons in log:
+            if game.game_over:
+                break
+            if ticks % every == 0:
+                states.append(copy.deepcopy(game))
+            ticks += 1
+            for button in buttons:
+                game.push_input(button)
+            game.advance()
+    return states
+
+# give a game between 1 and 4 full rows at the bottom of the board, so that clear_lines has something to clear
+def add_full_rows(game, rng):
+    board = game.board
+    for row in range(len(board.rows) - rng.randint(1, 4), len(board.rows)):
+        board.place([[row, col] for col in range(len(board.heights))], 1)
+    return game
+
+# time one engine function on fresh copies of every state, and measure the memory it allocates
+# returns (calls per second, average peak bytes allocated per call, average change in allocated memory blocks per call)
+# the change in blocks is what a call keeps minus what it frees, so it is negative for calls that free more than they allocate, e.g. clearing rows
+def bench_function(states, prepare, call):
+    games = [prepare(copy.deepcopy(state)) for state in states]
+    elapsed = 0
+    for game in games:
+        start = time.perf_counter()
+        call(game)
+        elapsed += time.perf_counter() - start
+
+    games = [prepare(copy.deepcopy(state)) for state in states]
+    peak_bytes = 0
+    kept_blocks = 0
+    tracemalloc.start()
+    for game in games:
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        blocks = sys.getallocatedblocks()
+        call(game)
+        peak_bytes += tracemalloc.get_traced_memory()[1] - before
+        kept_blocks += sys.getallocatedblocks() - blocks
+    tracemalloc.stop()
+    return len(games) / elapsed, peak_bytes / len(games), kept_blocks / len(games)
+
+# queue a few random button presses on a game without ticking it
+def with_random_buttons(rng):
+    def prepare(game):
+        for press in range(rng.randint(0, 3)):
+            game.push_input(rng.choice([headless.left, headless.right, headless.left, headless.right, headless.rotate, headless.down]))
+        return game
+    return prepare
+
+# make the game render its board from scratch instead of returning the last frame
+def without_frame(game):
+    game.frame_key = None
+    return game
+
+def keep(game):
+    return game
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the tetris engine on seeded input scripts.')
+    parser.add_argument('--games', type=int, default=200, help='number of seeded games to play')
+    parser.add_argument('--pieces', type=int, default=200, help='most pieces in each game')
+    parser.add_argument('--engine', default='engine', help='module with the Game class to benchmark')
+    parser.add_argument('--workload', choices=['auto', 'random'], default='auto', help='games played by the autoplayer (needs numpy), or random scripts that end quickly')
+    args = parser.parse_args()
+
+    game_class = importlib.import_module(args.engine).Game
+    rng = random.Random(0)
+    if args.workload == 'auto':
+        try:
+            logs = autoplayer_logs(args.games, args.pieces)
+        except ImportError:
+            parser.error('the auto workload needs numpy, install it or use --workload random')
+    else:
+        logs = random_logs(args.games, args.pieces)
+
+    ticks, lines, elapsed = bench_games(game_class, logs)
+    states = collect_states(game_class, logs[:max(1, args.games // 10)])
+    results = [
+        ('can_fall', bench_function(states, keep, lambda game: game.can_fall())),
+        ('take_inputs', bench_function(states, with_random_buttons(rng), lambda game: game.take_inputs())),
+        ('rotate_shape', bench_function(states, keep, lambda game: game.rotate_shape())),
+        ('do_wall_kicks', bench_function(states, keep, lambda game: game.do_wall_kicks((game.rotation_pos + 1) % 4))),
+        ('clear_lines', bench_function(states, lambda game: add_full_rows(game, rng), lambda game: game.clear_lines())),
+        ('format_board_as_str', bench_function(states, without_frame, lambda game: game.format_board_as_str())),
+        ('advance', bench_function(states, with_random_buttons(rng), lambda game: game.advance())),
+    ]
+
+    print('engine: {}  workload: {}  games: {}  ticks: {}  lines: {}'.format(args.engine, args.workload, args.games, ticks, lines))
+    print('{:>12.0f} ticks/sec'.format(ticks / elapsed))
+    print('{:>12.1f} line clears/sec'.format(lines / elapsed))
+    print()
+    print('{:<20} {:>12} {:>14} {:>16}'.format('function', 'calls/sec', 'peak B/call', 'net blocks/call'))
+    for name, (calls_per_sec, peak_bytes, kept_blocks) in results:
+        print('{:<20} {:>12.0f} {:>14.1f} {:>16.2f}'.format(name, calls_per_sec, peak_bytes, kept_blocks))
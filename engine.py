@@ -0,0 +1,437 @@
+# the tetris game itself: the board, the pieces and the rules. Nothing in here needs discord, so games can also be run without the bot
+import logging
+import random
+from collections import deque
+
+logger = logging.getLogger('tetris.engine')
+
+# size of the game board
+no_of_rows = 13 # represents rows
+no_of_cols = 10 # represents columns
+
+# emoji strings in discord to represent differently coloured pieces in tetris
+empty_sq = ':black_large_square:'
+blue_sq = ':blue_square:'
+brown_sq = ':brown_square:'
+orange_sq = ':orange_square:'
+yellow_sq = ':yellow_square:'
+green_sq = ':green_square:'
+purple_sq = ':purple_square:'
+red_sq = ':red_square:'
+ghost_sq = ':white_large_square:' # shows where the falling piece will land
+
+show_ghost = True # draw where the falling piece will land
+
+# buttons a player can press. The letters are also used in input scripts
+left = 'L'
+right = 'R'
+down = 'D'
+rotate = 'U'
+tick = '.' # marks the end of a tick in an input log
+
+max_inputs = 16 # presses a game holds on to before it starts dropping the oldest ones
+
+# colour of every square is stored as a small number, which is turned back into an emoji only when the board is displayed
+colour_emojis = [empty_sq, blue_sq, brown_sq, orange_sq, yellow_sq, green_sq, purple_sq, red_sq] # index 0 is an empty square
+colour_codes = {emoji: code for code, emoji in enumerate(colour_emojis)} # emoji string -> colour number
+
+
+class TetrisPieces: # represents tetris pieces, with every rotation state worked out once when the piece is created
+    # called when a new piece, i.e. instance, is created
+    def __init__(self, squares, box_size, starting_pos, colour, wall_kicks):
+        self.starting_pos = starting_pos # [row, column] of the top-left corner of the piece's box when it appears on the game board
+        self.colour = colour # represents the color of the piece
+        self.colour_code = colour_codes[colour] # colour number stored on the board
+        # squares of the piece in each of the 4 rotation states, as [row, column] offsets from the top-left corner of its box
+        # each state is the previous one turned clockwise inside the box
+        self.rotations = []
+        for rotation_pos in range(4):
+            self.rotations.append(tuple(squares))
+            squares = [(col, box_size - 1 - row) for row, col in squares]
+        # lowest square of the piece in each of its columns, as (column offset, row offset) pairs for each rotation state. Used to work out how far the piece can fall
+        self.bottoms = []
+        for squares in self.rotations:
+            lowest = {}
+            for row, col in squares:
+                lowest[col] = max(row, lowest.get(col, row))
+            self.bottoms.append(tuple(lowest.items()))
+        self.wall_kicks = wall_kicks # for each rotation state, the offsets to try in order when rotating clockwise out of it
+
+main_wall_kicks = [ # stores data for rotating the J, L, T, S, and Z tetris pieces
+                    [[0, 0], [0, -1], [-1, -1], [2, 0], [2, -1]],
+                    [[0, 0], [0, 1], [1, 1], [-2, 0], [-2, 1]],
+                    [[0, 0], [0, 1], [-1, 1], [2, 0], [2, 1]],
+                    [[0, 0], [0, -1], [1, -1], [-2, 0], [-2, -1]]
+                    ]
+
+i_wall_kicks = [ # stores data for rotating the I tetris piece
+                [[0, 0], [0, -2], [0, 1], [1, -2], [-2, 1]],
+                [[0, 0], [0, -1], [0, 2], [-2, -1], [1, 2]],
+                [[0, 0], [0, 2], [0, -1], [-1, 2], [2, -1]],
+                [[0, 0], [0, 1], [0, -2], [2, 1], [-1, -2]]
+                ]
+
+o_wall_kicks = [[[0, 0]]] * 4 # the O tetris piece looks the same in every rotation state, so it is never kicked
+
+# squares of each tetris piece in its first rotation state, followed by the size of its box, its starting position, its assigned colour and its wall kicks
+shape_I = TetrisPieces([(1, 0), (1, 1), (1, 2), (1, 3)], 4, [-1, 3], blue_sq, i_wall_kicks)
+shape_J = TetrisPieces([(0, 0), (1, 0), (1, 1), (1, 2)], 3, [-1, 3], brown_sq, main_wall_kicks)
+shape_L = TetrisPieces([(0, 2), (1, 0), (1, 1), (1, 2)], 3, [-1, 3], orange_sq, main_wall_kicks)
+shape_O = TetrisPieces([(0, 0), (0, 1), (1, 0), (1, 1)], 2, [-1, 4], yellow_sq, o_wall_kicks)
+shape_S = TetrisPieces([(0, 1), (0, 2), (1, 0), (1, 1)], 3, [-1, 3], green_sq, main_wall_kicks)
+shape_T = TetrisPieces([(0, 1), (1, 0), (1, 1), (1, 2)], 3, [-1, 3], purple_sq, main_wall_kicks)
+shape_Z = TetrisPieces([(0, 0), (0, 1), (1, 1), (1, 2)], 3, [-1, 3], red_sq, main_wall_kicks)
+shapes = [shape_I, shape_J, shape_L, shape_O, shape_S, shape_T, shape_Z]
+
+
+line_scores = [0, 100, 300, 500, 800] # points for clearing 0, 1, 2, 3 or 4 lines at once
+
+full_row = (1 << no_of_cols) - 1 # bitmask of a row where every column is filled
+empty_row_str = empty_sq * no_of_cols + "\n " # a row without any squares, as it is displayed
+
+
+class Board: # the game board, stored as one integer bitmask per row where bit c is set if column c is filled
+    def __init__(self):
+        self.rows = [0] * no_of_rows # occupancy of each row, used for every collision check
+        self.colours = bytearray(no_of_rows * no_of_cols) # colour number of each square, only used for rendering
+        self.row_strs = [empty_row_str] * no_of_rows # each row already joined into emojis, so rendering only has to join the rows
+        self.dirty_rows = set() # rows whose string in row_strs is out of date
+        self.version = 0 # goes up whenever a square changes, so an unchanged board can be recognised
+        self.heights = [no_of_rows] * no_of_cols # topmost filled row of each column, or no_of_rows if the column is empty
+
+    # check whether every square of a shape is inside the board and empty. Squares above the top of the board (negative rows) count as free, so new pieces can spawn there
+    def fits(self, shape):
+        rows = self.rows
+        for square in shape:
+            square_row = square[0]
+            square_col = square[1]
+            if not (0 <= square_col < no_of_cols) or square_row >= no_of_rows:
+                return False
+            if square_row >= 0 and rows[square_row] >> square_col & 1:
+                return False
+        return True
+
+    # lock a shape into the board with the given colour number
+    def place(self, shape, colour_code):
+        rows = self.rows
+        colours = self.colours
+        for square in shape:
+            square_row = square[0]
+            square_col = square[1]
+            if square_row >= 0: # squares above the board are lost
+                rows[square_row] |= 1 << square_col
+                colours[square_row * no_of_cols + square_col] = colour_code
+                self.dirty_rows.add(square_row)
+                if square_row < self.heights[square_col]:
+                    self.heights[square_col] = square_row
+        self.version += 1
+
+    # replace every square of the board, e.g. with a board from a snapshot. rows and colours are stored the same way as in the board
+    def load(self, rows, colours):
+        self.rows = list(rows)
+        self.colours = bytearray(colours)
+        self.dirty_rows = set(range(no_of_rows))
+        self.version += 1
+        self.update_heights()
+
+    # empty every square on the board
+    def clear(self):
+        self.rows = [0] * no_of_rows
+        self.colours = bytearray(no_of_rows * no_of_cols)
+        self.row_strs = [empty_row_str] * no_of_rows
+        self.dirty_rows.clear()
+        self.heights = [no_of_rows] * no_of_cols
+        self.version += 1
+
+    # remove full rows in one pass: the rows that aren't full are collected in order, and a fresh empty row is added at the top for each removed row
+    # the cached row strings move together with their rows, so only the new empty rows at the top change
+    # returns how many rows were removed, and which rows they were
+    def clear_lines(self):
+        rows = self.rows
+        if full_row not in rows:
+            return 0, []
+        kept_rows = []
+        cleared_rows = []
+        for row in range(no_of_rows):
+            if rows[row] == full_row:
+                cleared_rows.append(row)
+            else:
+                kept_rows.append(row)
+        lines_to_clear = len(cleared_rows)
+
+        colours = self.colours
+        row_strs = self.row_strs
+        self.rows = [0] * lines_to_clear + [rows[row] for row in kept_rows]
+        self.colours = bytearray(lines_to_clear * no_of_cols) + b''.join([colours[row * no_of_cols:(row + 1) * no_of_cols] for row in kept_rows])
+        self.row_strs = [empty_row_str] * lines_to_clear + [row_strs[row] for row in kept_rows]
+        if self.dirty_rows:
+            # dirty rows keep their flag at their new position
+            self.dirty_rows = {lines_to_clear + new_row for new_row, row in enumerate(kept_rows) if row in self.dirty_rows}
+
+        self.version += 1
+        self.update_heights()
+        return lines_to_clear, cleared_rows
+
+    # find the topmost filled row of every column again after rows have moved
+    def update_heights(self):
+        heights = self.heights
+        heights[:] = [no_of_rows] * no_of_cols
+        unknown = full_row # columns whose height hasn't been found yet
+        row = 0
+        for row_mask in self.rows:
+            found = row_mask & unknown # columns whose topmost square is in this row
+            if found:
+                unknown ^= found
+                while found:
+                    lowest_bit = found & -found
+                    heights[lowest_bit.bit_length() - 1] = row
+                    found ^= lowest_bit
+                if not unknown:
+                    break
+            row += 1
+
+    # join the emojis of one row, with a newline character after the last square in the row
+    def make_row_str(self, row):
+        return ''.join([colour_emojis[code] for code in self.colours[row * no_of_cols:(row + 1) * no_of_cols]]) + "\n "
+
+    # format the game board as a string representation with newline characters (line breakers) at the end of each row, allowing the board to be displayed to the user
+    # the falling shape is not part of the board, so it is drawn on top of it here, together with the ghost showing where it will land. Only the rows that changed and the rows the shape covers are rebuilt
+    def format_board_as_str(self, shape=(), shape_colour=empty_sq, ghost=()):
+        row_strs = self.row_strs
+        for row in self.dirty_rows:
+            row_strs[row] = self.make_row_str(row)
+        self.dirty_rows.clear()
+
+        board_rows = row_strs[:]
+        shape_rows = {} # squares of the ghost and the shape in each row, as (column, emoji) pairs
+        for square in ghost:
+            if square[0] >= 0:
+                shape_rows.setdefault(square[0], []).append((square[1], ghost_sq))
+        for square in shape: # drawn after the ghost, so the shape covers it where they overlap
+            if square[0] >= 0:
+                shape_rows.setdefault(square[0], []).append((square[1], shape_colour))
+        for row, cols in shape_rows.items():
+            squares = [colour_emojis[code] for code in self.colours[row * no_of_cols:(row + 1) * no_of_cols]]
+            for col, emoji in cols:
+                squares[col] = emoji
+            board_rows[row] = ''.join(squares) + "\n "
+        return ''.join(board_rows)
+
+
+# move every square of a shape by the given number of rows and columns
+def shift_shape(shape, row_amnt, col_amnt):
+    return [[square[0] + row_amnt, square[1] + col_amnt] for square in shape]
+
+
+class Game: # holds the state of one game of tetris
+    # called when a new game is created. Games with the same seed get the same pieces in the same order
+    def __init__(self, seed=None):
+        if seed is None:
+            seed = random.getrandbits(32)
+        self.seed = seed
+        self.rng = random.Random(seed) # picks the pieces of this game only
+        self.log = logging.LoggerAdapter(logger, {'game': seed}) # adds which game a log record came from
+        self.board = Board() # the locked squares of the game board
+        # the falling piece
+        self.piece = None # which TetrisPieces it is
+        self.piece_pos = [0, 0] # [row, column] of the top-left corner of its box
+        self.cur_shape_pos = [] # squares it covers on the board
+
+        # stores the player's score and number of lines cleared
+        self.points = 0
+        self.lines = 0
+
+        # tracks user input: every button press that hasn't been used yet, oldest first
+        # presses don't expire, as a rate limited channel can leave several seconds between ticks
+        self.inputs = deque(maxlen=max_inputs)
+        # every button that was used, followed by tick after every tick. Together with the seed this is enough to play the game again
+        self.input_log = []
+
+        self.rotation_pos = 0 # angle of rotation of a piece is defaulted to 0
+        self.is_new_shape = False # tracks whether a new tetris piece has been placed on the board
+        self.game_over = False # keeps the game running, game stops if set to True
+        self.index = 0 # number of pieces that have been given out
+
+        # the last board string made by format_board_as_str, and what it was made from
+        self.frame = None
+        self.frame_key = None
+
+    # squares that the falling piece would cover in the given rotation state, moved by the given number of rows and columns
+    def get_shape_pos(self, rotation_pos, row_amnt=0, col_amnt=0):
+        row = self.piece_pos[0] + row_amnt
+        col = self.piece_pos[1] + col_amnt
+        return [[row + square[0], col + square[1]] for square in self.piece.rotations[rotation_pos]]
+
+    # format the game board, including the falling piece, as a string
+    # if neither the board nor the falling piece has changed since the last call, the previous string is returned as it is
+    def format_board_as_str(self):
+        if self.piece is None:
+            frame_key = (self.board.version, None)
+        else:
+            frame_key = (self.board.version, self.piece.colour_code, self.rotation_pos, self.piece_pos[0], self.piece_pos[1])
+        if frame_key != self.frame_key:
+            if self.piece is None:
+                self.frame = self.board.format_board_as_str()
+            else:
+                drop_distance = self.get_drop_distance()
+                ghost = shift_shape(self.cur_shape_pos, drop_distance, 0) if show_ghost and drop_distance > 0 else ()
+                self.frame = self.board.format_board_as_str(self.cur_shape_pos, self.piece.colour, ghost)
+            self.frame_key = frame_key
+        return self.frame
+
+    # generates a random tetris piece for the game and makes it the falling piece
+    def get_random_shape(self):
+        # set random_shape as a random shape object from the list of shapes, which is done by generating a random integer between 0 and 6.
+        random_shape = shapes[self.rng.randint(0, 6)]
+        self.index += 1
+        self.piece = random_shape
+        self.rotation_pos = 0 # new pieces start in their first rotation state
+        self.piece_pos = random_shape.starting_pos[:]
+        self.cur_shape_pos = self.get_shape_pos(0)
+        self.is_new_shape = True
+        # the game is over if the new piece lands on the stack or can't fall at all
+        if not self.board.fits(self.cur_shape_pos) or self.get_drop_distance() == 0:
+            self.game_over = True
+            self.log.debug('No room for piece %s', self.index)
+        return random_shape
+
+    # draw count pieces without giving them out, so that a game restored from a snapshot goes on with the same pieces as the original
+    def skip_pieces(self, count):
+        for piece in range(count):
+            self.rng.randint(0, 6)
+
+    # how many rows the falling piece can fall
+    # compares the lowest square of the piece in each column with the height of that column, instead of checking the board row by row
+    def get_drop_distance(self):
+        heights = self.board.heights
+        row, col = self.piece_pos
+        drop_distance = no_of_rows
+        for bottom in self.piece.bottoms[self.rotation_pos]:
+            square_row = row + bottom[1]
+            square_col = col + bottom[0]
+            if square_row >= heights[square_col]: # piece is under an overhang, so check the board row by row
+                return self.scan_drop_distance()
+            if heights[square_col] - 1 - square_row < drop_distance:
+                drop_distance = heights[square_col] - 1 - square_row
+        return drop_distance
+
+    # how many rows the falling piece can fall, found by checking one row further down at a time
+    def scan_drop_distance(self):
+        drop_distance = 0
+        while self.board.fits(shift_shape(self.cur_shape_pos, drop_distance + 1, 0)):
+            drop_distance += 1
+        return drop_distance
+
+    # rotate the falling piece clockwise. The rotation state only changes if the piece fits after one of its wall kicks
+    def rotate_shape(self):
+        new_rotation_pos = (self.rotation_pos + 1) % 4
+        kick = self.do_wall_kicks(new_rotation_pos)
+        if kick is None:
+            return False
+        self.piece_pos = [self.piece_pos[0] + kick[0], self.piece_pos[1] + kick[1]]
+        self.rotation_pos = new_rotation_pos
+        self.cur_shape_pos = self.get_shape_pos(new_rotation_pos)
+        return True
+
+    # handles 'wall kicks', i.e. adjustments made to the position of a tetris piece after it has been rotated
+    # wall kicks are necessary to ensure that a tetris piece doesn't get stuck against the wall or another piece after it has been rotated
+    # returns the first kick that makes the rotated piece fit, or None if it doesn't fit anywhere
+    def do_wall_kicks(self, new_rotation_pos):
+        for kick in self.piece.wall_kicks[self.rotation_pos]:
+            if self.board.fits(self.get_shape_pos(new_rotation_pos, kick[0], kick[1])): # shape does fit
+                self.log.debug('Rotated to state %s with kick %s', new_rotation_pos, kick)
+                return kick
+
+        self.log.debug('Kept old, unrotated shape')
+        return None
+
+    # remove full rows and add their score. Returns the rows that were removed
+    def clear_lines(self):
+        lines_to_clear, cleared_rows = self.board.clear_lines()
+        # scoring system
+        self.points += line_scores[lines_to_clear]
+        self.lines += lines_to_clear
+        return cleared_rows
+
+    # check if the falling shape can move down one row, i.e. the square below it isn't taken
+    def can_fall(self):
+        return self.get_drop_distance() > 0
+
+    # queue a button press for the next tick. Once max_inputs presses are waiting, the oldest one is dropped
+    def push_input(self, button):
+        self.inputs.append(button)
+
+    # use the queued presses in the order they were pressed. Presses of the same sideways button in a row are merged into one move of several columns
+    # returns True if down was pressed, which drops and locks the piece and ends the tick. Presses after it are kept for the next piece
+    def take_inputs(self):
+        inputs = self.inputs
+        while inputs:
+            button = inputs.popleft()
+            self.input_log.append(button)
+            if button == left or button == right:
+                step = -1 if button == left else 1
+                col_amnt = step
+                while inputs and inputs[0] == button:
+                    inputs.popleft()
+                    self.input_log.append(button)
+                    col_amnt += step
+                self.shift_piece(col_amnt)
+            elif button == rotate:
+                self.rotate_shape()
+            elif button == down:
+                self.hard_drop()
+                return True
+        return False
+
+    # move the falling piece col_amnt columns sideways, one column at a time, stopping in front of the first column where it doesn't fit
+    def shift_piece(self, col_amnt):
+        step = 1 if col_amnt > 0 else -1
+        for col in range(abs(col_amnt)):
+            shifted_shape = shift_shape(self.cur_shape_pos, 0, step)
+            if not self.board.fits(shifted_shape):
+                break
+            self.cur_shape_pos = shifted_shape
+            self.piece_pos = [self.piece_pos[0], self.piece_pos[1] + step]
+
+    # move the game forward by one tick: use the buttons pressed since the last tick, then move the falling shape down or lock it into the board
+    def advance(self):
+        dropped = self.take_inputs()
+        self.input_log.append(tick)
+        if dropped: # piece was dropped and locked
+            return
+
+        # move/place shape if position is available
+        if self.can_fall():
+            # move every square of the shape one row down
+            self.piece_pos = [self.piece_pos[0] + 1, self.piece_pos[1]]
+            self.cur_shape_pos = shift_shape(self.cur_shape_pos, 1, 0)
+            self.is_new_shape = False # has been placed, so not new anymore
+        else:
+            self.lock_piece()
+
+    # drop the falling piece straight to the furthest available space and lock it there. Returns the rows that were cleared
+    def hard_drop(self):
+        drop_distance = self.get_drop_distance()
+        self.piece_pos = [self.piece_pos[0] + drop_distance, self.piece_pos[1]]
+        self.cur_shape_pos = shift_shape(self.cur_shape_pos, drop_distance, 0)
+        return self.lock_piece()
+
+    # lock the falling piece into the board where it is, clear full lines, and give out the next piece. Returns the rows that were cleared
+    def lock_piece(self):
+        self.board.place(self.cur_shape_pos, self.piece.colour_code) # lock the shape into the board
+        cleared_rows = self.clear_lines() # check for full lines and clear them
+        self.log.debug('Locked piece %s, cleared %s lines', self.index, len(cleared_rows))
+        self.get_random_shape() # change shape
+        return cleared_rows
+
+    # turn the falling piece to the given rotation state, move it to the given row and column, then drop and lock it, all without ticking
+    # used to play games quickly when every move is already decided, e.g. by the autoplayer
+    # returns the rows that were cleared, or None without changing the game if the piece doesn't fit there
+    def drop_piece(self, rotation_pos, row, col):
+        shape_pos = [[row + square[0], col + square[1]] for square in self.piece.rotations[rotation_pos]]
+        if not self.board.fits(shape_pos):
+            return None
+        self.rotation_pos = rotation_pos
+        self.piece_pos = [row, col]
+        self.cur_shape_pos = shape_pos
+        return self.hard_drop()
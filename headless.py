@@ -0,0 +1,77 @@
+# plays games of tetris without discord, from a seed and a script of button presses. Used to test and benchmark the engine
+import argparse
+import logging
+import random
+
+from engine import Game, left, right, down, rotate, tick
+
+# buttons in an input script, one character per tick: the engine's buttons, or no button
+no_button = '.'
+
+# press a button in a game, the same way a reaction does in the bot
+def press(game, button):
+    if button != no_button:
+        game.push_input(button)
+
+# play one game: before every tick the next button of the script is pressed. The game stops when it is over or the script runs out
+# game_class can be swapped for another engine, so that engines can be compared on the same input
+def play(seed, script, game_class=Game):
+    game = game_class(seed)
+    game.get_random_shape()
+    for button in script:
+        if game.game_over:
+            break
+        press(game, button)
+        game.advance()
+    return game
+
+class ReplayPlayer: # presses the buttons of an input log (see Game.input_log), one tick at a time. Can also be the autoplayer of a game in the bot
+    def __init__(self, input_log):
+        self.input_log = input_log # the log as a string
+        self.position = 0 # index of the next button in the log
+
+    def finished(self):
+        return self.position >= len(self.input_log)
+
+    # press every button that was used in the next tick of the logged game
+    def press(self, game):
+        end = self.input_log.find(tick, self.position)
+        if end == -1:
+            end = len(self.input_log)
+        for button in self.input_log[self.position:end]:
+            game.push_input(button)
+        self.position = end + 1
+
+# play a game again from its seed and input log. Gives the same game as the one that was logged
+def replay(seed, input_log, game_class=Game):
+    game = game_class(seed)
+    game.get_random_shape()
+    player = ReplayPlayer(input_log)
+    while not game.game_over and not player.finished():
+        player.press(game)
+        game.advance()
+    return game
+
+# make a script of random buttons that is always the same for the same seed
+# the script plays one piece at a time: rotate it, slide it to one side, drop it, then wait a tick
+def random_script(seed, no_of_pieces):
+    rng = random.Random(seed)
+    script = []
+    for piece in range(no_of_pieces):
+        script.append(rotate * rng.randint(0, 3) + rng.choice([left, right]) * rng.randint(0, 5) + down + no_button)
+    return ''.join(script)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Play a game of tetris without discord and show the final board.')
+    parser.add_argument('--seed', type=int, default=0, help='seed that picks the pieces')
+    parser.add_argument('--script', help='buttons to press, one per tick: L left, R right, D down, U rotate, . nothing (default: random buttons from the seed)')
+    parser.add_argument('--pieces', type=int, default=200, help='number of pieces in the random script')
+    parser.add_argument('--debug', action='store_true', help='log every rotation and locked piece')
+    args = parser.parse_args()
+    if args.debug:
+        logging.basicConfig(level=logging.DEBUG, format='%(levelname)s %(name)s [game %(game)s] %(message)s')
+
+    script = args.script if args.script is not None else random_script(args.seed, args.pieces)
+    game = play(args.seed, script)
+    print(game.format_board_as_str())
+    print('Score: {}  Lines: {}  Pieces: {}  Game over: {}'.format(game.points, game.lines, game.index, game.game_over))
@@ -0,0 +1,23 @@
+# sets up logging for the bot. Log records are put on a queue and written out by a background thread, so the event loop never waits on output
+import logging
+import logging.handlers
+import queue
+import sys
+
+# every record shows the process and the game it came from. Records that don't belong to a game show '-'
+log_format = '%(asctime)s {} %(levelname)-7s %(name)s [game %(game)s] %(message)s'
+
+
+# send all log records through a queue to stderr. source names this process in every record, e.g. the shards it runs
+# returns the listener that writes them, which should be stopped on shutdown so that no records are lost
+def setup_logging(level='INFO', source='bot'):
+    log_queue = queue.SimpleQueue()
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(logging.Formatter(log_format.format(source), defaults={'game': '-'}))
+    listener = logging.handlers.QueueListener(log_queue, handler)
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    listener.start()
+    return listener
@@ -0,0 +1,169 @@
+# measures where the time of the bot goes: latency histograms, counters and gauges, shown as prometheus text, and a sampling profiler
+# nothing in here needs discord, the bot decides what gets measured
+import asyncio
+import bisect
+import os
+import sys
+import threading
+import time
+
+# upper bounds in seconds of the buckets that latencies are counted in, from engine functions (well under a millisecond) to slow discord requests
+latency_buckets = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Histogram: # counts how many measurements fell into each latency bucket
+    def __init__(self, buckets=latency_buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # the last count is for measurements above every bucket
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    # upper bound of the bucket that holds the given fraction of the measurements, e.g. 0.95 for the 95th percentile
+    def quantile(self, fraction):
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= fraction * self.count:
+                return self.buckets[index] if index < len(self.buckets) else float('inf')
+        return 0
+
+
+class HistogramFamily: # one histogram for each value of a label, e.g. one for each phase of a tick
+    def __init__(self, name, label, description):
+        self.name = name
+        self.label = label
+        self.description = description
+        self.histograms = {} # label value -> Histogram
+
+    def observe(self, label_value, value):
+        histogram = self.histograms.get(label_value)
+        if histogram is None:
+            histogram = Histogram()
+            self.histograms[label_value] = histogram
+        histogram.observe(value)
+
+
+class Metrics: # every counter, gauge and histogram of the bot
+    def __init__(self):
+        self.started = time.monotonic()
+        self.counters = {} # name -> [description, value]
+        self.gauges = {} # name -> [description, function that returns the current value]
+        self.families = [] # HistogramFamily objects
+
+    def counter(self, name, description):
+        self.counters[name] = [description, 0]
+
+    def count(self, name, amount=1):
+        self.counters[name][1] += amount
+
+    def gauge(self, name, description, function):
+        self.gauges[name] = [description, function]
+
+    def histogram(self, name, label, description):
+        family = HistogramFamily(name, label, description)
+        self.families.append(family)
+        return family
+
+    def uptime(self):
+        return time.monotonic() - self.started
+
+    # every metric in the prometheus text format
+    def prometheus_text(self):
+        lines = []
+        for name, (description, value) in self.counters.items():
+            lines += ['# HELP {} {}'.format(name, description), '# TYPE {} counter'.format(name), '{} {}'.format(name, value)]
+        for name, (description, function) in self.gauges.items():
+            lines += ['# HELP {} {}'.format(name, description), '# TYPE {} gauge'.format(name), '{} {}'.format(name, function())]
+        for family in self.families:
+            lines += ['# HELP {} {}'.format(family.name, family.description), '# TYPE {} histogram'.format(family.name)]
+            for label_value, histogram in family.histograms.items():
+                label = '{}="{}"'.format(family.label, label_value)
+                total = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    total += count
+                    lines.append('{}_bucket{{{},le="{}"}} {}'.format(family.name, label, bound, total))
+                lines.append('{}_bucket{{{},le="+Inf"}} {}'.format(family.name, label, histogram.count))
+                lines.append('{}_sum{{{}}} {}'.format(family.name, label, histogram.sum))
+                lines.append('{}_count{{{}}} {}'.format(family.name, label, histogram.count))
+        return '\n'.join(lines) + '\n'
+
+
+# wrap a function so that every call to it is timed into a histogram under the given label
+# used on methods, e.g. rotate_shape = timed(phase_seconds, 'rotate', Game.rotate_shape)
+def timed(family, label_value, function):
+    def timed_function(*args):
+        start = time.perf_counter()
+        try:
+            return function(*args)
+        finally:
+            family.observe(label_value, time.perf_counter() - start)
+    return timed_function
+
+# serve the metrics as prometheus text over http on host:port, for any path. Returns the asyncio server
+async def serve_metrics(metrics, host, port):
+    async def handle(reader, writer):
+        try:
+            while (await reader.readline()).strip(): # skip the request line and headers
+                pass
+            body = metrics.prometheus_text().encode()
+            writer.write(b'HTTP/1.0 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\nContent-Length: ' + str(len(body)).encode() + b'\r\n\r\n' + body)
+            await writer.drain()
+        finally:
+            writer.close()
+    return await asyncio.start_server(handle, host, port)
+
+
+class SamplingProfiler: # takes the stack of the event loop thread every few milliseconds from a background thread, and counts the stacks seen during each game's ticks
+    def __init__(self, interval=0.005):
+        self.interval = interval # seconds between samples
+        self.session = None # key of the game whose tick is running right now, set by the game. Samples taken outside of a tick count for 'bot'
+        self.stacks = {} # game key -> {folded stack: number of samples}
+        self.thread = None
+        self.thread_id = None # thread that is sampled
+
+    def running(self):
+        return self.thread is not None
+
+    # start sampling the thread that calls this
+    def start(self):
+        if self.running():
+            return
+        self.stacks = {}
+        self.thread_id = threading.get_ident()
+        self.thread = threading.Thread(target=self.sample, name='sampling-profiler', daemon=True)
+        self.thread.start()
+
+    def sample(self):
+        while self.thread is not None:
+            frame = sys._current_frames().get(self.thread_id)
+            key = self.session if self.session is not None else 'bot'
+            stack = []
+            while frame is not None:
+                stack.append(os.path.basename(frame.f_code.co_filename) + ':' + frame.f_code.co_name)
+                frame = frame.f_back
+            folded = ';'.join(reversed(stack)) # outermost call first, as flame graph tools expect
+            stacks = self.stacks.setdefault(key, {})
+            stacks[folded] = stacks.get(folded, 0) + 1
+            time.sleep(self.interval)
+
+    # stop sampling and write the stacks of each game to <directory>/<game key>.folded, which flame graph tools can read. Returns the files written
+    def stop(self, directory):
+        thread = self.thread
+        self.thread = None
+        if thread is None:
+            return []
+        thread.join()
+        os.makedirs(directory, exist_ok=True)
+        paths = []
+        for key, stacks in self.stacks.items():
+            path = os.path.join(directory, '{}.folded'.format(key))
+            with open(path, 'w') as file:
+                for folded, samples in sorted(stacks.items()):
+                    file.write('{} {}\n'.format(folded, samples))
+            paths.append(path)
+        return paths
@@ -0,0 +1,146 @@
+# saves running games in a small binary file, so that the bot can be restarted without losing them
+# the board is stored as its row bitmasks and colour numbers, never as emoji strings, so packing a game takes a few microseconds
+# every snapshot carries a checksum of its games, so that a file left half written, e.g. by a crash or power loss during a write, is recognised and ignored
+import logging
+import mmap
+import os
+import struct
+import zlib
+
+from engine import Game, shapes, no_of_rows, no_of_cols
+
+logger = logging.getLogger('tetris.snapshot')
+
+magic = b'TTBS'
+file_version = 2
+file_header = struct.Struct('<4sHIII') # magic, file_version, number of games, length of the games in bytes, crc32 of the games
+
+# everything about a game except its board and input log:
+# message id, channel id, player id (0 for none), player name (utf-8, cut to 32 bytes), seed, pieces given out, points, lines,
+# falling piece (index in shapes), rotation state, row and column of the piece, flags, length of the input log
+game_header = struct.Struct('<QQQ32sQIIIBBhhBI')
+board_rows = struct.Struct('<{}H'.format(no_of_rows)) # one bitmask per row
+colours_size = no_of_rows * no_of_cols # one colour number per square
+
+# flags of a game
+new_shape_flag = 1
+autoplay_flag = 2 # the bot plays the game by itself
+
+
+class SavedGame: # a game read back from a snapshot, with what the bot needs to reattach it to its message
+    def __init__(self, msg_id, channel_id, player, autoplay, game):
+        self.msg_id = msg_id
+        self.channel_id = channel_id
+        self.player = player # SavedPlayer, or None if nobody pressed play
+        self.autoplay = autoplay
+        self.game = game
+
+class SavedPlayer: # the player of a restored game. Has the same id and display_name as the discord user, which is all the leaderboard needs
+    def __init__(self, id, display_name):
+        self.id = id
+        self.display_name = display_name
+
+
+# pack one running game into bytes
+def pack_game(game, msg_id, channel_id, player_id=0, player_name='', autoplay=False):
+    flags = (new_shape_flag if game.is_new_shape else 0) | (autoplay_flag if autoplay else 0)
+    input_log = ''.join(game.input_log).encode()
+    header = game_header.pack(msg_id, channel_id, player_id, player_name.encode()[:32], game.seed, game.index, game.points, game.lines,
+                              shapes.index(game.piece), game.rotation_pos, game.piece_pos[0], game.piece_pos[1], flags, len(input_log))
+    return header + board_rows.pack(*game.board.rows) + game.board.colours + input_log
+
+# pack the games of a snapshot, together with the file header
+def pack_snapshot(packed_games):
+    games = b''.join(packed_games)
+    return file_header.pack(magic, file_version, len(packed_games), len(games), zlib.crc32(games)) + games
+
+# read every game out of a snapshot. game_class is the class the games are restored as, which is called with the seed
+# a snapshot that is damaged, or from another version of the bot, is logged and gives no games
+def unpack_games(data, game_class=Game):
+    if len(data) < file_header.size:
+        logger.warning('Ignored snapshot: file is too short')
+        return []
+    magic_bytes, version, no_of_games, length, checksum = file_header.unpack_from(data, 0)
+    if magic_bytes != magic or version != file_version:
+        logger.warning('Ignored snapshot: not a snapshot of this version of the bot')
+        return []
+    games = data[file_header.size:file_header.size + length]
+    if len(games) != length or zlib.crc32(games) != checksum:
+        logger.warning('Ignored snapshot: file is damaged, e.g. by a write that was cut short')
+        return []
+    try:
+        return read_games(games, no_of_games, game_class)
+    except (struct.error, UnicodeDecodeError, IndexError) as error: # can only happen if the checksum missed the damage
+        logger.warning('Ignored snapshot: %r', error)
+        return []
+
+# read no_of_games games out of the packed games of a snapshot
+def read_games(data, no_of_games, game_class):
+    saved_games = []
+    offset = 0
+    for number in range(no_of_games):
+        (msg_id, channel_id, player_id, player_name, seed, pieces, points, lines,
+         piece, rotation_pos, row, col, flags, log_length) = game_header.unpack_from(data, offset)
+        offset += game_header.size
+        rows = board_rows.unpack_from(data, offset)
+        offset += board_rows.size
+        if offset + colours_size + log_length > len(data):
+            raise IndexError('game {} goes past the end of the snapshot'.format(number))
+        colours = data[offset:offset + colours_size]
+        offset += colours_size
+        input_log = bytes(data[offset:offset + log_length]).decode()
+        offset += log_length
+
+        game = game_class(seed)
+        game.skip_pieces(pieces) # the next piece comes out of the rng as it would have in the original game
+        game.index = pieces
+        game.points = points
+        game.lines = lines
+        game.board.load(rows, colours)
+        game.piece = shapes[piece]
+        game.rotation_pos = rotation_pos
+        game.piece_pos = [row, col]
+        game.cur_shape_pos = game.get_shape_pos(rotation_pos)
+        game.is_new_shape = bool(flags & new_shape_flag)
+        game.input_log = list(input_log)
+        player = SavedPlayer(player_id, player_name.rstrip(b'\0').decode(errors='ignore')) if player_id else None
+        saved_games.append(SavedGame(msg_id, channel_id, player, bool(flags & autoplay_flag), game))
+    return saved_games
+
+
+class SnapshotFile: # a snapshot file that is written through a memory map, so writing one is a copy into memory that the OS saves to disk by itself
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+        self.map = None
+
+    # replace the snapshot with the given packed games
+    def write(self, packed_games):
+        data = pack_snapshot(packed_games)
+        if self.map is None or len(self.map) < len(data):
+            self.open(max(len(data) * 2, mmap.PAGESIZE)) # leave room to grow, so that the file isn't resized every time
+        self.map[:len(data)] = data
+
+    # (re)open the file with at least size bytes
+    def open(self, size):
+        self.close()
+        self.file = open(self.path, 'a+b')
+        if os.path.getsize(self.path) < size:
+            self.file.truncate(size)
+        self.map = mmap.mmap(self.file.fileno(), 0)
+
+    # the snapshot that is in the file, or None if there is none
+    def read(self):
+        if not os.path.exists(self.path) or os.path.getsize(self.path) < file_header.size:
+            return None
+        with open(self.path, 'rb') as file:
+            return file.read()
+
+    # write the memory map out to disk and close the file
+    def close(self):
+        if self.map is not None:
+            self.map.flush()
+            self.map.close()
+            self.file.close()
+            self.map = None
+            self.file = None
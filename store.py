@@ -0,0 +1,143 @@
+# keeps finished games in a sqlite file: the scores for the leaderboard, and the seed and input log that replay each game
+# games are written in batches by a background task, and leaderboards and replays are read through a small cache
+import asyncio
+import logging
+import sqlite3
+import time
+import zlib
+from collections import OrderedDict, deque
+
+logger = logging.getLogger('tetris.store')
+
+schema = '''
+CREATE TABLE IF NOT EXISTS games (
+    id INTEGER PRIMARY KEY,
+    guild_id INTEGER NOT NULL, -- 0 for games played in direct messages
+    user_id INTEGER NOT NULL,
+    user_name TEXT NOT NULL,
+    points INTEGER NOT NULL,
+    lines INTEGER NOT NULL,
+    pieces INTEGER NOT NULL,
+    seed INTEGER NOT NULL,
+    inputs BLOB NOT NULL, -- zlib compressed input log
+    finished REAL NOT NULL -- unix time
+);
+CREATE INDEX IF NOT EXISTS games_by_score ON games (guild_id, points DESC);
+CREATE INDEX IF NOT EXISTS games_by_user ON games (user_id, guild_id, id DESC);
+'''
+
+
+class LRUCache: # holds the most recently used query results, dropping the least recently used one once it is full
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.items = OrderedDict()
+
+    # the cached value, or None if there isn't one
+    def get(self, key):
+        value = self.items.get(key)
+        if value is not None:
+            self.items.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self.items[key] = value
+        self.items.move_to_end(key)
+        if len(self.items) > self.maxsize:
+            self.items.popitem(last=False)
+
+    def discard(self, key):
+        self.items.pop(key, None)
+
+
+class GameStore: # the sqlite file of finished games
+    def __init__(self, path, batch_size=500, flush_interval=1, cache_size=256, busy_timeout=10, retry_interval=5):
+        self.path = path
+        self.batch_size = batch_size # most games written in one transaction
+        self.flush_interval = flush_interval # seconds the writer waits after a game finishes, so that games finishing around the same time are written together
+        self.busy_timeout = busy_timeout # seconds to wait for another process (e.g. another shard group of the supervisor) that is writing to the same file
+        self.retry_interval = retry_interval # seconds to wait before writing games again after a write failed
+        self.pending = deque() # finished games that haven't been written yet
+        self.wakeup = asyncio.Event() # set when a game is added to pending
+        self.version = 0 # counts writes, so that a leaderboard read during a write isn't cached
+        self.top_cache = LRUCache(cache_size) # (guild id, limit) -> leaderboard rows
+        self.replay_cache = LRUCache(cache_size) # game id -> (seed, input log). Games never change, so these stay valid
+        self.writer = None # connection for writing, only used by one thread at a time
+        self.reader = None # connection for reading
+
+    def open(self):
+        self.writer = sqlite3.connect(self.path, timeout=self.busy_timeout, check_same_thread=False)
+        self.writer.execute('PRAGMA journal_mode=WAL') # reads don't wait for writes
+        self.writer.executescript(schema)
+        self.reader = sqlite3.connect(self.path, timeout=self.busy_timeout, check_same_thread=False)
+
+    # queue a finished game to be written. Doesn't wait for the database
+    def save(self, guild_id, user_id, user_name, points, lines, pieces, seed, input_log):
+        inputs = zlib.compress(''.join(input_log).encode())
+        self.pending.append((guild_id, user_id, user_name, points, lines, pieces, seed, inputs, time.time()))
+        self.wakeup.set()
+
+    # write queued games in batches forever. Games that couldn't be written are tried again every retry_interval seconds
+    async def run(self):
+        while True:
+            await self.wakeup.wait()
+            await asyncio.sleep(self.flush_interval)
+            self.wakeup.clear()
+            guild_ids = await asyncio.to_thread(self.write_pending)
+            self.version += 1
+            for key in list(self.top_cache.items):
+                if key[0] in guild_ids:
+                    self.top_cache.discard(key)
+            if self.pending: # a write failed, e.g. because the file was locked for longer than busy_timeout
+                await asyncio.sleep(self.retry_interval)
+                self.wakeup.set()
+
+    # write every queued game, batch_size games per transaction. Returns the guilds that got new games
+    # stops at the first batch that fails, and leaves it and the rest queued. Also called without the event loop on shutdown, so that no finished game is lost
+    def write_pending(self):
+        guild_ids = set()
+        while self.pending:
+            batch = [self.pending.popleft() for game in range(min(self.batch_size, len(self.pending)))]
+            try:
+                with self.writer:
+                    self.writer.executemany('INSERT INTO games (guild_id, user_id, user_name, points, lines, pieces, seed, inputs, finished) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', batch)
+            except sqlite3.Error:
+                self.pending.extendleft(reversed(batch)) # put the games back in front, in the same order
+                logger.exception('Could not write %s finished games, will try again', len(self.pending))
+                break
+            guild_ids.update(game[0] for game in batch)
+        return guild_ids
+
+    def close(self):
+        self.write_pending()
+        self.writer.close()
+        self.reader.close()
+
+    # the best games of a guild, as (id, user name, points, lines) rows
+    async def top(self, guild_id, limit=10):
+        key = (guild_id, limit)
+        rows = self.top_cache.get(key)
+        if rows is None:
+            version = self.version
+            rows = await asyncio.to_thread(self.query, 'SELECT id, user_name, points, lines FROM games WHERE guild_id = ? ORDER BY points DESC LIMIT ?', (guild_id, limit))
+            if version == self.version: # nothing was written meanwhile
+                self.top_cache.put(key, rows)
+        return rows
+
+    # (seed, input log) of a game, or None if there is no game with that id
+    async def replay(self, game_id):
+        replay = self.replay_cache.get(game_id)
+        if replay is None:
+            rows = await asyncio.to_thread(self.query, 'SELECT seed, inputs FROM games WHERE id = ?', (game_id,))
+            if not rows:
+                return None
+            replay = (rows[0][0], zlib.decompress(rows[0][1]).decode())
+            self.replay_cache.put(game_id, replay)
+        return replay
+
+    # id of the last game a user finished in a guild, or None
+    async def latest(self, user_id, guild_id):
+        rows = await asyncio.to_thread(self.query, 'SELECT id FROM games WHERE user_id = ? AND guild_id = ? ORDER BY id DESC LIMIT 1', (user_id, guild_id))
+        return rows[0][0] if rows else None
+
+    def query(self, sql, parameters):
+        return self.reader.execute(sql, parameters).fetchall()
@@ -0,0 +1,88 @@
+# runs the bot as several processes, each with its own group of shards, and restarts any process that dies
+# run with: python supervisor.py --shards 8 --workers 4
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import time
+
+min_restart_delay = 1 # seconds to wait before restarting a process that died
+max_restart_delay = 60 # a process that keeps dying waits twice as long each time, up to this many seconds
+stable_time = 60 # a process that ran for this many seconds is working again, so its restart delay starts over
+
+
+class Worker: # one bot process and the shards it runs
+    def __init__(self, index, shard_ids, shard_count):
+        self.index = index
+        self.shard_ids = shard_ids
+        self.env = dict(os.environ, SHARD_COUNT=str(shard_count), SHARD_IDS=','.join(str(shard_id) for shard_id in shard_ids))
+        if os.getenv('METRICS_PORT'): # every process serves its own metrics, on consecutive ports
+            self.env['METRICS_PORT'] = str(int(os.getenv('METRICS_PORT')) + index)
+        self.process = None
+        self.started = 0
+        self.restart_delay = min_restart_delay
+        self.restart_at = 0 # time to restart the process at, after it died
+
+    def start(self):
+        self.process = subprocess.Popen([sys.executable, 'ttb.py'], env=self.env, cwd=os.path.dirname(os.path.abspath(__file__)))
+        self.started = time.monotonic()
+        print('Started worker {} (pid {}) with shards {}'.format(self.index, self.process.pid, self.env['SHARD_IDS']), flush=True)
+
+    # restart the process if it died, waiting longer each time it keeps dying
+    def check(self):
+        now = time.monotonic()
+        if self.process is not None:
+            if self.process.poll() is None:
+                if now - self.started > stable_time:
+                    self.restart_delay = min_restart_delay
+                return
+            print('Worker {} exited with code {}, restarting in {}s'.format(self.index, self.process.returncode, self.restart_delay), flush=True)
+            self.process = None
+            self.restart_at = now + self.restart_delay
+            self.restart_delay = min(max_restart_delay, self.restart_delay * 2)
+        if now >= self.restart_at:
+            self.start()
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+
+
+# split the shards into groups of neighbouring shard ids, one group for each worker
+def split_shards(shard_count, no_of_workers):
+    groups = [[] for worker in range(min(no_of_workers, shard_count))]
+    for shard_id in range(shard_count):
+        groups[shard_id * len(groups) // shard_count].append(shard_id)
+    return groups
+
+# start every worker, then keep them running until the supervisor is stopped
+def supervise(shard_count, no_of_workers, check_interval=1):
+    workers = [Worker(index, shard_ids, shard_count) for index, shard_ids in enumerate(split_shards(shard_count, no_of_workers))]
+    running = True
+
+    def stop(signum, frame):
+        nonlocal running
+        running = False
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    while running:
+        for worker in workers:
+            worker.check()
+        time.sleep(check_interval)
+
+    # let every process write out its games and logs before exiting
+    for worker in workers:
+        worker.stop()
+    for worker in workers:
+        if worker.process is not None:
+            worker.process.wait()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the bot as several processes with a group of shards each, restarting processes that die.')
+    parser.add_argument('--shards', type=int, required=True, help='total number of shards, see the recommended count in the Discord Developer Portal')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of bot processes')
+    args = parser.parse_args()
+    supervise(args.shards, args.workers)
@@ -0,0 +1,38 @@
+# tests for the placements the autoplayer chooses from. Skipped when numpy isn't installed
+# run with: python -m pytest
+import pytest
+
+pytest.importorskip('numpy')
+
+import autoplayer
+from engine import Game, shape_I
+
+
+def test_every_reachable_placement_fits_at_its_row():
+    game = Game(0)
+    game.piece = shape_I
+    game.rotation_pos = 0
+    game.piece_pos = shape_I.starting_pos[:]
+    game.cur_shape_pos = game.get_shape_pos(0)
+    game.board.place([[2, 3], [2, 5], [2, 6]], 1) # makes some turns kick the piece up
+    placements = autoplayer.reachable_placements(game)
+    assert placements
+    for rotation_pos, row, col in placements:
+        shape = [[row + square[0], col + square[1]] for square in shape_I.rotations[rotation_pos]]
+        assert game.board.fits(shape)
+
+def test_drop_piece_refuses_a_placement_that_doesnt_fit():
+    game = Game(0)
+    game.get_random_shape()
+    game.board.place([[5, col] for col in range(10) if col != 4], 1)
+    rows = game.board.rows[:]
+    assert game.drop_piece(game.rotation_pos, 5, 0) is None
+    assert game.board.rows == rows
+
+def test_games_played_by_the_autoplayer_never_overlap_pieces():
+    for game in autoplayer.play_games(range(10), 100):
+        if game.game_over: # squares above the top of the board may have been lost
+            continue
+        # every locked piece added 4 squares and every cleared line took 10 away, so a piece locked over other squares would show up here
+        squares = sum(bin(row).count('1') for row in game.board.rows)
+        assert squares == 4 * (game.index - 1) - 10 * game.lines
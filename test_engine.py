@@ -0,0 +1,144 @@
+# tests for the rules of the engine, and for playing a game again from its input log or a snapshot
+# run with: python -m pytest
+import headless
+from engine import Game, Board, shape_I, shape_O, shape_T, full_row, no_of_rows, no_of_cols, ghost_sq, tick
+from snapshot import SnapshotFile, pack_game, pack_snapshot, unpack_games
+
+
+# a game whose falling piece is the given piece, in the given rotation state with the top-left corner of its box at pos
+def game_with_piece(piece, rotation_pos, pos):
+    game = Game(0)
+    game.piece = piece
+    game.rotation_pos = rotation_pos
+    game.piece_pos = list(pos)
+    game.cur_shape_pos = game.get_shape_pos(rotation_pos)
+    return game
+
+# everything that makes up the state of a game, to compare two games with
+def game_state(game):
+    return (game.index, game.points, game.lines, game.game_over, game.board.rows, bytes(game.board.colours), game.board.heights,
+            game.piece, game.rotation_pos, game.piece_pos, game.cur_shape_pos, game.input_log)
+
+
+def test_rotation_kicks_t_piece_off_the_left_wall():
+    game = game_with_piece(shape_T, 1, [3, -1]) # standing up against the left wall, box sticking out of the board
+    assert game.rotate_shape()
+    assert game.rotation_pos == 2
+    assert game.piece_pos == [3, 0] # second kick moves it one column right
+    assert sorted(game.cur_shape_pos) == [[4, 0], [4, 1], [4, 2], [5, 1]]
+
+def test_rotation_kicks_i_piece_off_the_right_wall():
+    game = game_with_piece(shape_I, 1, [3, 7]) # standing up in the last column
+    assert game.rotate_shape()
+    assert game.rotation_pos == 2
+    assert game.piece_pos == [3, 6]
+    assert sorted(game.cur_shape_pos) == [[5, 6], [5, 7], [5, 8], [5, 9]]
+
+def test_rotation_fails_when_no_kick_fits():
+    game = game_with_piece(shape_I, 1, [9, -2]) # standing up in a well in the first column
+    game.board.load([full_row & ~1] * no_of_rows, bytes(no_of_rows * no_of_cols))
+    assert not game.rotate_shape()
+    assert game.rotation_pos == 1
+    assert game.piece_pos == [9, -2]
+
+def test_o_piece_never_moves_when_rotated():
+    game = game_with_piece(shape_O, 0, [5, 8])
+    squares = sorted(game.cur_shape_pos)
+    for turn in range(4):
+        assert game.rotate_shape()
+        assert sorted(game.cur_shape_pos) == squares
+
+
+def test_clear_lines_removes_several_rows_and_moves_the_rest_down():
+    game = Game(0)
+    board = game.board
+    board.place([[10, col] for col in range(no_of_cols)], 1)
+    board.place([[12, col] for col in range(no_of_cols)], 1)
+    board.place([[11, 0]], 3)
+    board.place([[9, 5]], 4)
+    assert game.clear_lines() == [10, 12]
+    assert (game.lines, game.points) == (2, 300)
+    assert board.rows == [0] * 11 + [1 << 5, 1]
+    assert board.colours[11 * no_of_cols + 5] == 4
+    assert board.colours[12 * no_of_cols] == 3
+    assert board.heights == [12] + [no_of_rows] * 4 + [11] + [no_of_rows] * 4
+
+def test_clear_lines_without_full_rows():
+    board = Board()
+    board.place([[12, 0]], 1)
+    assert board.clear_lines() == (0, [])
+    assert board.rows[12] == 1
+
+
+def test_heights_and_drop_distance_on_an_empty_board():
+    game = game_with_piece(shape_O, 0, [-1, 4])
+    assert game.board.heights == [no_of_rows] * no_of_cols
+    assert game.get_drop_distance() == no_of_rows - 1
+
+def test_drop_distance_and_ghost_under_an_overhang():
+    game = game_with_piece(shape_O, 0, [9, 4]) # below a square hanging in the air
+    game.board.place([[8, 4]], 1)
+    assert game.board.heights[4] == 8
+    assert game.get_drop_distance() == 2
+    assert game.get_drop_distance() == game.scan_drop_distance()
+    assert game.format_board_as_str().count(ghost_sq) == 4
+    game.hard_drop()
+    assert game.board.rows[11] == game.board.rows[12] == 0b11 << 4
+    assert game.board.heights[4] == 8 and game.board.heights[5] == 11
+
+
+def test_replay_gives_the_same_game():
+    for seed in range(20):
+        script = headless.random_script(seed, 50)
+        game = headless.play(seed, script)
+        replayed = headless.replay(seed, ''.join(game.input_log))
+        assert game_state(replayed) == game_state(game)
+
+def test_input_log_merges_sideways_presses_and_marks_ticks():
+    game = Game(1)
+    game.get_random_shape()
+    for button in 'LLRU':
+        game.push_input(button)
+    game.advance()
+    game.advance()
+    assert ''.join(game.input_log) == 'LLRU' + tick + tick
+
+
+def test_snapshot_round_trip(tmp_path):
+    games = []
+    for seed in range(8):
+        game = Game(seed)
+        game.get_random_shape()
+        for button in headless.random_script(seed, 3)[:12]:
+            headless.press(game, button)
+            game.advance()
+        games.append(game)
+    snapshots = SnapshotFile(str(tmp_path / 'snapshot.bin'))
+    snapshots.write([pack_game(game, 100 + number, 7, 42, 'ann', number % 2 == 1) for number, game in enumerate(games)])
+    snapshots.close()
+
+    saved_games = unpack_games(snapshots.read())
+    assert [saved.msg_id for saved in saved_games] == [100 + number for number in range(len(games))]
+    for number, (saved, game) in enumerate(zip(saved_games, games)):
+        assert (saved.channel_id, saved.player.id, saved.player.display_name, saved.autoplay) == (7, 42, 'ann', number % 2 == 1)
+        restored = saved.game
+        assert game_state(restored) == game_state(game)
+        # both games go on the same way, with the same pieces
+        for button in headless.random_script(number, 10):
+            for copy in (game, restored):
+                headless.press(copy, button)
+                copy.advance()
+        assert game_state(restored) == game_state(game)
+
+def test_damaged_snapshot_gives_no_games():
+    game = Game(3)
+    game.get_random_shape()
+    for button in 'LUR':
+        headless.press(game, button)
+        game.advance()
+    data = pack_snapshot([pack_game(game, 1, 2), pack_game(game, 3, 4)])
+    assert len(unpack_games(data)) == 2
+    flipped = bytearray(data)
+    flipped[-1] ^= 0xff # a corrupt input log
+    for damaged in (data[:len(data) // 2], data[:5], bytes(flipped), b'not a snapshot at all'):
+        assert unpack_games(damaged) == []
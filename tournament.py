@@ -0,0 +1,68 @@
+# plays many seeded games in parallel worker processes and prints statistics while the games finish
+# each worker plays its games with its own engine and only sends back (seed, score, lines, pieces) for every game, never whole boards
+# run with: python tournament.py [--games N] [--workers N] [--player auto|random]
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import headless
+
+
+# play a chunk of seeded games in a worker process and return one small result tuple per game
+def play_chunk(seeds, max_pieces, player):
+    if player == 'auto':
+        import autoplayer # numpy is only needed by workers that use the autoplayer
+        games = autoplayer.play_games(seeds, max_pieces)
+    else:
+        games = [headless.play(seed, headless.random_script(seed, max_pieces)) for seed in seeds]
+    return [(game.seed, game.points, game.lines, game.index) for game in games]
+
+
+class TournamentStats: # running totals of the games that have finished so far
+    def __init__(self):
+        self.games = 0
+        self.points = 0
+        self.lines = 0
+        self.pieces = 0
+        self.best = None # (score, seed) of the best game
+
+    def add(self, seed, points, lines, pieces):
+        self.games += 1
+        self.points += points
+        self.lines += lines
+        self.pieces += pieces
+        if self.best is None or points > self.best[0]:
+            self.best = (points, seed)
+
+    def summary(self, elapsed):
+        return '{:>6} games  avg score {:>9.1f}  avg lines {:>7.1f}  best {} (seed {})  {:>8.0f} pieces/sec'.format(
+            self.games, self.points / self.games, self.lines / self.games, self.best[0], self.best[1], self.pieces / elapsed)
+
+
+# play games with the given seeds across a pool of worker processes, yielding the running statistics every time a chunk of games finishes
+def run_tournament(seeds, max_pieces, player='auto', workers=None, chunk_size=25):
+    seeds = list(seeds)
+    stats = TournamentStats()
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        chunks = [pool.submit(play_chunk, seeds[index:index + chunk_size], max_pieces, player) for index in range(0, len(seeds), chunk_size)]
+        for chunk in as_completed(chunks):
+            for result in chunk.result():
+                stats.add(*result)
+            yield stats, time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Play many seeded games in parallel and report statistics as they finish.')
+    parser.add_argument('--games', type=int, default=1000, help='number of games to play')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the first game, the others count up from it')
+    parser.add_argument('--pieces', type=int, default=500, help='stop each game after this many pieces')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of worker processes')
+    parser.add_argument('--chunk', type=int, default=25, help='games handed to a worker at a time')
+    parser.add_argument('--player', choices=['auto', 'random'], default='auto', help='autoplayer (needs numpy) or random seeded button scripts')
+    args = parser.parse_args()
+
+    seeds = range(args.seed, args.seed + args.games)
+    for stats, elapsed in run_tournament(seeds, args.pieces, args.player, args.workers, args.chunk):
+        print('[{:>7.2f}s] {}'.format(elapsed, stats.summary(elapsed)), flush=True)
@@ -1,487 +1,813 @@
 # import discord.py, RNG, and asyncio for running coroutines (lines of code that act on the occurence of an event loop)
 import discord
-from discord.ext import commands
-import random
+from discord.ext import commands, tasks
 import asyncio
+import logging
+import signal
+import time
+
+# the game board, pieces and rules
+from engine import Game, left, right, down, rotate
+
+# playing logged games again, and storing finished games
+from headless import ReplayPlayer
+from store import GameStore, LRUCache
+from snapshot import SnapshotFile, pack_game, unpack_games
+
+# measuring where the time goes
+from metrics import Metrics, SamplingProfiler, timed, serve_metrics
 
 # for storing bot token
 import os
 from dotenv import load_dotenv
 
+from logs import setup_logging
+
 load_dotenv()
 
 TOKEN = os.getenv("DISCORD_TOKEN")
 
-# represents the game board as a 2d list
-board = []
-no_of_rows = 13 # represents rows
-no_of_cols = 10 # represents columns
-
-# emoji strings in discord to represent differently coloured pieces in tetris
-empty_sq = ':black_large_square:'
-blue_sq = ':blue_square:'
-brown_sq = ':brown_square:'
-orange_sq = ':orange_square:'
-yellow_sq = ':yellow_square:'
-green_sq = ':green_square:'
-purple_sq = ':purple_square:'
-red_sq = ':red_square:'
+log_listener = setup_logging(os.getenv("LOG_LEVEL", "INFO"), 'shards ' + os.getenv("SHARD_IDS") if os.getenv("SHARD_IDS") else 'bot') # set LOG_LEVEL=DEBUG to see every button press and rotation
+logger = logging.getLogger('tetris.bot')
 
 embed_colour = 0x00a36c # colour of line on embeds
 
-# stores players' scores and number of lines cleared
-points = 0
-lines = 0
-
-# tracks user input
-down_pressed = False 
-rotate_clockwise = False
-
-rotation_pos = 0 # angle of rotation of a piece is defaulted to 0
-h_movement = 0 # amount to move left or right
-is_new_shape = False # tracks whether a new tetris piece has been placed on the board
-start_higher = False # used when tetris piece is near the top of the board
-game_over = False # keeps the game running, game stops if set to True
-index = 0
-
-
-class TetrisPieces: # represents tetris pieces
-    # called when a new piece, i.e. instance, is created
-    def __init__(self, starting_pos, colour, rotation_points):
-        self.starting_pos = starting_pos # list that represents the starting position of the piece on the game board
-        self.colour = colour # represents the color of the piece
-        self.rotation_points = rotation_points # list of lists that stores data for rotating the tetris piece
-
-main_wall_kicks = [ # stores data for rotating the J, L, T, S, and Z tetris pieces
-                    [[0, 0], [0, -1], [-1, -1], [2, 0], [2, -1]],
-                    [[0, 0], [0, 1], [1, 1], [-2, 0], [-2, 1]],
-                    [[0, 0], [0, 1], [-1, 1], [2, 0], [2, 1]],
-                    [[0, 0], [0, -1], [1, -1], [-2, 0], [-2, -1]]
-                    ]
-
-i_wall_kicks = [ # stores data for rotating the I tetris piece
-                [[0, 0], [0, -2], [0, 1], [1, -2], [-2, 1]],
-                [[0, 0], [0, -1], [0, 2], [-2, -1], [1, 2]],
-                [[0, 0], [0, 2], [0, -1], [-1, 2], [2, -1]],
-                [[0, 0], [0, 1], [0, -2], [2, 1], [-1, -2]]
-                ]
-
-rot_adjustments = { # a dictionary to store data for adjusting tetris piece positions after rotations
-                # blue: no adjustment needed
-                ':blue_square:': [[0, 1], [-1, -1], [0, 0], [-1, 0]], #[[0, 0], [0, 0], [0, 0], [0, 0]]
-                # brown: left 1, right 1, right 1, left 1,
-                ':brown_square:': [[0, 0], [0, 1], [0, 0], [0, -1]], #[[0, -1], [0, 1], [0, 1], [0, -1]]'
-                # orange: left 1, nothing, right 1, nothing
-                ':orange_square:': [[0, -1], [0, 0], [-1, 1], [0, 0]], #[[0, -1], [0, 0], [0, 1], [0, 0]]
-                # yellow: no adjustment needed
-                ':yellow_square:': [[0, 0], [0, 0], [0, 0], [0, 0]],
-                # green: right 1, nothing, right 1, nothing
-                ':green_square:': [[0, 0], [0, 0], [0, 0], [0, 0]], #[[0, 1], [0, 0], [0, 1], [0, 0]]
-                # purple: nothing, right 1, left 1, right 1
-                ':purple_square:': [[0, 0], [1, 1], [0, -1], [0, 1]], #[[0, 0], [0, 1], [0, -1], [0, 1]]
-                #red: left 1, up 1, right 1, up 1
-                ':red_square:': [[1, -1], [-1, -1], [0, 2], [-1, -1]] #[[0, -1], [-1, 0], [0, 1], [-1, 0]]
-                }
-
-# starting positions for each tetris piece, followed by their assigned colour and rotation points
-shape_I = TetrisPieces([[0, 3], [0, 4], [0, 5], [0, 6]], blue_sq, [1, 1, 1, 1])
-shape_J = TetrisPieces([[0, 3], [0, 4], [0, 5], [-1, 3]], brown_sq, [1, 1, 2, 2])
-shape_L = TetrisPieces([[0, 3], [0, 4], [0, 5], [-1, 5]], orange_sq, [1, 2, 2, 1])
-shape_O = TetrisPieces([[0, 4], [0, 5], [-1, 4], [-1, 5]], yellow_sq, [1, 1, 1, 1])
-shape_S = TetrisPieces([[0, 3], [0, 4], [-1, 4], [-1, 5]], green_sq, [2, 2, 2, 2])
-shape_T = TetrisPieces([[0, 3], [0, 4], [0, 5], [-1, 4]], purple_sq, [1, 1, 3, 0])
-shape_Z = TetrisPieces([[0, 4], [0, 5], [-1, 3], [-1, 4]], red_sq, [0, 1, 0, 2])
-
-
-#fill board with empty squares
-def make_empty_board():
-    for row in range(no_of_rows):
-        # add a new empty row to the game board
-        board.append([])
-        for col in range(no_of_cols):
-            # add an empty square to the current row of the game board
-            board[row].append(empty_sq)
-
-# fill the game board with a given emoji (the emojis are the coloured squares). This function will be used to fill the board with empty squares, i.e. black squares.
-def fill_board(emoji):
-    for row in range(no_of_rows):
-        for col in range(no_of_cols):
-            # checks whether the square is already filled with the given emoji string. If the square is not already filled with the given emoji string, the function replaces the square with the given emoji string
-            if board[row][col] != emoji:
-                board[row][col] = emoji
-
-# format the game board as a string representation with newline characters (line breakers) at the end of each row, allowing the board to be displayed to the user
-def format_board_as_str():
-    # create an empty string that will hold the string representation of the game board, which then iterates over the rows and columns of the board using the following 'for' loops
-    board_as_str = ''
-    for row in range(no_of_rows):
-        for col in range(no_of_cols):
-            # adds emojis for each square to the string representation of the game board
-            board_as_str += (board[row][col])
-            # Add a newline character after the last square in the row
-            if col == no_of_cols - 1:
-                board_as_str += "\n "
-    # return the string representation of the game board
-    return board_as_str
-
-# generates a random tetris piece for the game
-def get_random_shape():
-    global index
-    shapes = [shape_I, shape_J, shape_L, shape_O, shape_S, shape_T, shape_Z]
-    # set random_shape as a random shape object from the above list, which is done by generating a random integer between 0 and 6.
-    random_shape = shapes[random.randint(0, 6)]
-    index += 1
-    # if start_higher is True, the function iterates over the starting_pos attribute of the random_shape object and subtracts 1 from the row value of each square in the attribute
-    # this effectively moves the tetris piece up one row on the game board
-    if start_higher == True:
-        for s in random_shape.starting_pos[:]:
-            s[0] = s[0] - 1
-    else:
-        # if start_higher is False, the function initializes a variable called starting_pos and sets it equal to a copy of the starting_pos attribute of the random_shape object.
-        starting_pos = random_shape.starting_pos[:]
-    random_shape = [random_shape.starting_pos[:], random_shape.colour, random_shape.rotation_points] #gets starting point of shapes and copies, doesn't change them
-    global is_new_shape
-    is_new_shape = True
-    # returns random_shape as a list containing starting_pos, colour, and rotation_points attributes
-    # effectively allowing the game to track the position, colour, and rotation data of the randomly generated tetris piece.
-    return random_shape
-
-def rotate_shape(shape, direction, rotation_point_index, shape_colour):
-    rotation_point = shape[rotation_point_index] # assigns the value of the square at the rotation_point_index of the shape variable to the rotation_point variable
-    new_shape = [] # to store coords of rotated shape
-
-    for square in shape:
-        # assign the value of the first and second element of the square to square_row and square_col respectively
-        square_row = square[0]
-        square_col = square[1]
-        # check if direction is clockwise
-        if direction == 'clockwise':
-            # calculate the new positions of the square after a clockwise rotation
-            new_square_row = (square_col - rotation_point[1]) + rotation_point[0] + rot_adjustments.get(shape_colour)[rotation_pos-1][0]
-            print('Adjustment made: ' + str(rot_adjustments.get(shape_colour)[rotation_pos-1][0]))
-            new_square_col = -(square_row - rotation_point[0]) + rotation_point[1] + rot_adjustments.get(shape_colour)[rotation_pos-1][1]
-            print('Adjustment made: ' + str(rot_adjustments.get(shape_colour)[rotation_pos-1][1]))
-        new_shape.append([new_square_row, new_square_col]) # store position of rotated square
-        if (0 <= square_col < no_of_cols) and (0 <= square_row < no_of_rows): # check if the new square is within the game board
-            board[square_row][square_col] = empty_sq # make the square at the old position empty on the game board
-
-    new_shape = do_wall_kicks(new_shape, shape, shape_colour, 0) # call do_wall_kicks to offset shape
-
-    new_shape = sorted(new_shape, key=lambda l:l[0], reverse=True) # sorts the new_shape list so that the bottom squares are first in the list
-    print('Rotated shape: ' + str(new_shape))
-
-    # place rotated shape (in case can't move down)
-    if new_shape != shape:
-        for square in new_shape:
-            square_row = square[0]
-            square_col = square[1]
-            board[square_row][square_col] = shape_colour
-
-    return new_shape
-
-# handles 'wall kicks', i.e. adjustments made to the position of a tetris piece after it has been rotated
-# wall kicks are necessary to ensure that a tetris piece doesn't get stuck against the wall or another piece after it has been rotated
-def do_wall_kicks(shape, old_shape_pos, shape_colour, attempt_kick_num):
-    new_shape_pos = []
-
-    # determine which set of wall kick to use based on shape colour
-    if shape_colour == blue_sq:
-        kick_set = main_wall_kicks[rotation_pos]
-    else:
-        kick_set = i_wall_kicks[rotation_pos]
-
-    print('Kick set: ' + str(kick_set))
-    for kick in kick_set:
-        print('Kick: ' + str(kick))
-        for square in shape:
-            # assign the value of the first and second element of the square to square_row and square_col respectively
-            square_row = square[0]
-            square_col = square[1]
-            # assign the value of square_row plus the value of the first element of kick to new_square_row and square_col plus the value of the second element of kick to new_square_col
-            new_square_row = square_row + kick[0]
-            new_square_col = square_col + kick[1]
-            if (0 <= new_square_col < no_of_cols) and (0 <= new_square_row < no_of_rows): # check if the new square is within the game board
-                square_checking = board[new_square_row][new_square_col] # get the square to check if empty
-                if (square_checking != empty_sq) and ([new_square_row, new_square_col] not in old_shape_pos): # if square is not empty / won't be when other parts of shape have moved
-                    # shape doesn't fit
-                    new_shape_pos = [] #reset new_shape
-                    break
-                else: # shape does fit
-                    new_shape_pos.append([new_square_row, new_square_col]) # store new position
-                    print('New shape: ' + str(new_shape_pos))
-                    if len(new_shape_pos) == 4:
-                        print('Returned new shape after doing kicks')
-                        return new_shape_pos # return shape with kicks added
-            else:
-                # shape doesn't fit
-                new_shape_pos = [] # reset new_shape
-                break
-
-    print('Returned old, unrotated shape')
-    return old_shape_pos # return shape without rotation
-
-def clear_lines():
-    # make the board, points and lines variables global, so that the function can modify their values
-    global board
-    global points
-    global lines
-    lines_to_clear = 0
-    for row in range(no_of_rows):
-        row_full = True # assume line is full
-        for col in range(no_of_cols):
-            if board[row][col] == empty_sq:
-                row_full = False
-                break # exit nested loop if the current square is empty
-        if row_full:
-            lines_to_clear += 1
-            board2 = board[:] # create a copy of the board variable
-            for r in range(row, 0, -1): # nested loop that iterates over each row above the current row from the bottom to the top
-                if r == 0: # check if current row is the top row
-                    for c in range(no_of_cols): # nested loop that iterates over each column of the top row
-                        board2[r][c] = empty_sq # make the current square of the top row empty
+session_timeout = 15 * 60 # seconds without a button press before a game is evicted
+max_evicted_messages = 1000 # messages of evicted games that are remembered, so that ▶ can start them again without fetching the message
+tick_interval = 1 # seconds between ticks when a game starts, to keep under discord's API rate limit
+min_tick_interval = 0.5 # fastest a game may tick while its channel keeps up with the edits
+max_tick_interval = 8 # slowest a game may tick while its channel is rate limited
+slow_edit_time = 0.75 # an edit taking longer than this many seconds was held back by discord's rate limit
+
+# how players control games: 'reactions', or 'buttons' for discord's message buttons, which don't use up any of the bot's rate limit when pressed
+control_mode = os.getenv("CONTROL_MODE", "reactions")
+controls = ["▶", "⬅", "⬇", "➡", "🔃", "❌"] # reactions added once to every game message: Play, Left, Down, Right, Rotate, Stop Game
+
+store = GameStore(os.getenv("DB_PATH", "ttb.sqlite3")) # scores and replays of finished games
+store.open()
+
+# running games are saved to this file every snapshot_interval seconds and on shutdown, and picked up again when the bot starts
+snapshot_interval = 5
+max_restore_attempts = 12 # times a game from the snapshot is tried again, one snapshot_interval apart, while its message can't be fetched
+snapshots = SnapshotFile(os.getenv("SNAPSHOT_PATH") or ('snapshot-{}.bin'.format(os.getenv("SHARD_IDS").replace(',', '-')) if os.getenv("SHARD_IDS") else 'snapshot.bin'))
+
+# discord's rate limits for editing messages
+channel_edit_rate = 1 # edits per second in one channel
+channel_edit_burst = 5 # edits that can be sent at once in one channel
+global_edit_rate = 50 # requests per second for the whole bot
+max_spectators = 25 # messages that can watch one game
+max_game_over_attempts = 3 # times the game over message is tried before giving up on it
+
+# sharding, see where the client is created
+shard_count = os.getenv("SHARD_COUNT")
+shard_ids = [int(shard_id) for shard_id in os.getenv("SHARD_IDS").split(',')] if os.getenv("SHARD_IDS") else None # None runs every shard
+
+# set METRICS_PORT to serve the metrics as prometheus text on that port of this machine
+metrics_port = os.getenv("METRICS_PORT")
+profile_dir = os.getenv("PROFILE_DIR", "profiles") # where t.profile writes its flame graph files
+
+metrics = Metrics()
+metrics.counter('tetris_ticks_total', 'Game ticks run')
+metrics.counter('tetris_frames_sent_total', 'Boards sent to discord')
+metrics.counter('tetris_frames_merged_total', 'Boards replaced by a newer one before they were sent')
+metrics.counter('tetris_slow_edits_total', 'Edits that took longer than slow_edit_time')
+metrics.counter('tetris_rate_limited_total', 'Requests that discord rejected with a 429')
+phase_seconds = metrics.histogram('tetris_tick_phase_seconds', 'phase', 'Time spent in each phase of a tick')
+request_seconds = metrics.histogram('tetris_discord_request_seconds', 'request', 'Time spent waiting for discord requests')
+profiler = SamplingProfiler() # off until t.profile turns it on
+
+
+class GameSession(Game): # a game that is played through a discord message, so that every game message gets its own board
+    # called when a new game message is created
+    def __init__(self, msg, seed=None):
+        Game.__init__(self, seed)
+        self.msg = None # the discord message that displays this game
+        self.shard_id = 0 # the shard that receives the reactions on the game message. A game only ever runs in the process of its shard
+        if msg is not None:
+            self.attach(msg)
+        self.stopped = False # set when the game is deleted or evicted, so that run_game stops
+        self.autoplayer = None # presses the buttons when the bot plays the game by itself
+        self.player = None # user who pressed play. Their finished game is saved to the leaderboard
+        self.saved = False # set once the finished game is saved, so that retrying the game over message doesn't save it again
+        self.game_over_attempts = 0 # times showing the game over message failed
+
+        self.last_active = time.monotonic() # time of the last button press, used to evict idle games
+
+        # used by the render pipeline
+        self.last_frame = None # board that the game message currently shows
+        self.pending_frame = None # newest board that hasn't been sent yet
+        self.frame_task = None # coroutine that is sending frames
+        self.frame_reserve = 0 # edits this game leaves unused in the rate limits, see Spectator
+
+    # the phases of a tick, timed into phase_seconds
+    advance = timed(phase_seconds, 'tick', Game.advance)
+    take_inputs = timed(phase_seconds, 'inputs', Game.take_inputs) # includes rotating, moving and dropping the piece
+    rotate_shape = timed(phase_seconds, 'rotate', Game.rotate_shape)
+    can_fall = timed(phase_seconds, 'collision', Game.can_fall)
+    lock_piece = timed(phase_seconds, 'placement', Game.lock_piece) # includes clear_lines and choosing the next piece
+    clear_lines = timed(phase_seconds, 'clear_lines', Game.clear_lines)
+    format_board_as_str = timed(phase_seconds, 'render', Game.format_board_as_str)
+
+    # show this game on a message, e.g. on the message it had before the bot restarted
+    def attach(self, msg):
+        self.msg = msg
+        self.log.extra['game'] = msg.id # log records of this game show its message id instead of its seed
+        self.shard_id = msg.guild.shard_id if msg.guild is not None else 0 # direct messages always go to shard 0
+
+    # whether the game has started and hasn't ended yet
+    def running(self):
+        return self.piece is not None and not self.game_over and not self.stopped
+
+    # record that a player interacted with this game
+    def touch(self):
+        self.last_active = time.monotonic()
+
+    # called by the render pipeline when the game message is gone, or the bot may not edit it anymore
+    def message_deleted(self):
+        end_session(self.msg.id)
+
+    # runs one tick of the game and shows the result. Returns how many seconds to wait before the next tick, or None once the game has ended
+    async def run_game(self):
+        if self.stopped: # game was deleted or evicted, stop running it
+            return None
+
+        msg = self.msg
+        profiler.session = msg.id # samples taken while the engine runs belong to this game
+        if self.game_over:
+            pass # the game over message failed last time. The game has ended, so it is only shown again
+        elif self.autoplayer is not None and self.autoplayer.finished():
+            self.game_over = True # a replay reached the end of its input log
+        else:
+            if self.autoplayer is not None:
+                self.autoplayer.press(self)
+                self.touch() # the bot is playing, so the game isn't abandoned. Once it is over, it is evicted like any other game
+            self.advance()
+            metrics.count('tetris_ticks_total')
+
+        if not self.game_over:
+            # update board, and every message that watches it
+            frame = self.format_board_as_str()
+            renderer.submit(self, frame)
+            for spectator in spectators.get(msg.id, ()):
+                renderer.submit(spectator, frame)
+            profiler.session = None
+            if self.is_new_shape:
+                return 0 # move a new shape onto the board straight away
+            return renderer.tick_interval(self)
+        else:
+            profiler.session = None
+            logger.info('Game over with %s points and %s lines (seed %s)', self.points, self.lines, self.seed, extra=self.log.extra)
+            if self.player is not None and not self.saved:
+                guild_id = msg.guild.id if msg.guild is not None else 0
+                store.save(guild_id, self.player.id, self.player.display_name, self.points, self.lines, self.index, self.seed, self.input_log)
+            self.saved = True # before the first await, so that a failed edit below can't save the game twice
+            await renderer.finish(self) # don't let an older frame replace the game over message
+            desc = 'Score: {} \n Lines: {} \n \n Press ▶ to play again.'.format(self.points, self.lines)
+            embed = discord.Embed(title='GAME OVER', description=desc, color=embed_colour)
+            await timed_request('edit', msg.edit(embed=embed)) # the controls stay on the message, so ▶ can start the next game
+            # show the game over message to every watcher at once. A watcher that fails doesn't affect the others
+            watchers = spectators.get(msg.id, [])
+            for spectator in watchers:
+                renderer.cancel(spectator)
+            await asyncio.gather(*[timed_request('edit', spectator.msg.edit(embed=embed)) for spectator in watchers], return_exceptions=True)
+            for spectator in watchers:
+                spectator.last_frame = None
+            return None
+
+
+class Spectator: # a message that shows a game running on another message, e.g. in another channel
+    # the spectator only gets the frames the game has already made, so watching adds discord requests but no engine work
+    def __init__(self, msg, game_msg_id):
+        self.msg = msg
+        self.game_msg_id = game_msg_id # message of the game being watched
+        self.stopped = False
+        self.log = logging.LoggerAdapter(logger, {'game': game_msg_id})
+
+        # used by the render pipeline
+        self.last_frame = None
+        self.pending_frame = None
+        self.frame_task = None
+        self.frame_reserve = 1 # an edit is only sent while the rate limits have one more left, so that watchers never hold up the players' own messages
+
+    # called by the render pipeline when the watching message is gone, or the bot may not edit it anymore
+    def message_deleted(self):
+        stop_watching(self)
+
+
+class TickScheduler: # runs the ticks of every game from one timer wheel, instead of one sleeping coroutine per game
+    def __init__(self, resolution=0.05, no_of_slots=64):
+        self.resolution = resolution # seconds between two slots of the wheel
+        self.wheel = [[] for slot in range(no_of_slots)] # each slot holds [session, rounds left] entries that are due when the wheel reaches it
+        self.cursor = 0 # slot that was handled last
+        self.tick_tasks = {} # ticks that are currently running, keyed by session, so that they can be cancelled
+        self.task = None # the coroutine that turns the wheel
+
+    # run a tick of the session after delay seconds
+    def schedule(self, session, delay):
+        no_of_slots = len(self.wheel)
+        slots_ahead = max(1, round(delay / self.resolution)) # a delay of 0 still waits for the next slot
+        self.wheel[(self.cursor + slots_ahead) % no_of_slots].append([session, (slots_ahead - 1) // no_of_slots])
+
+    # start running a game
+    def add(self, session):
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+        self.schedule(session, 0)
+
+    # stop running a game, including a tick that is waiting for discord
+    def cancel(self, session):
+        session.stopped = True
+        task = self.tick_tasks.pop(session, None)
+        if task is not None:
+            task.cancel()
+
+    # turn the wheel forever, starting the ticks of every game in each slot as the slot comes up
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        next_time = loop.time()
+        while True:
+            next_time += self.resolution
+            await asyncio.sleep(max(0, next_time - loop.time()))
+            self.cursor = (self.cursor + 1) % len(self.wheel)
+            due = self.wheel[self.cursor]
+            self.wheel[self.cursor] = []
+            for entry in due:
+                session = entry[0]
+                if session.stopped:
+                    continue # game was cancelled while waiting, drop it
+                if entry[1] > 0: # delay is longer than one turn of the wheel
+                    entry[1] -= 1
+                    self.wheel[self.cursor].append(entry)
+                    continue
+                self.tick_tasks[session] = asyncio.create_task(self.run_tick(session))
+
+    # run one tick of a game and schedule its next one
+    async def run_tick(self, session):
+        try:
+            delay = await session.run_game()
+        except (discord.NotFound, discord.Forbidden): # game message was deleted, or the bot may not edit it anymore
+            end_session(session.msg.id)
+            return
+        except Exception:
+            logger.exception('Tick failed', extra=session.log.extra)
+            delay = renderer.tick_interval(session) # try again on the next tick
+            if session.game_over: # only the game over message is sent again, the game itself has ended
+                session.game_over_attempts += 1
+                if session.game_over_attempts >= max_game_over_attempts:
+                    delay = None
+        finally:
+            if self.tick_tasks.get(session) is asyncio.current_task():
+                del self.tick_tasks[session]
+        if delay is not None and not session.stopped:
+            self.schedule(session, delay)
+
+
+class RateBucket: # token bucket that spaces out requests so that discord never has to reject them
+    def __init__(self, rate, capacity):
+        self.rate = rate # requests allowed per second
+        self.capacity = capacity # requests that can be sent in one burst
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    # seconds until the next request may be sent, while still leaving reserve requests for others
+    def delay(self, reserve=0):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1 + reserve:
+            return 0
+        return (1 + reserve - self.tokens) / self.rate
+
+    # use up one request
+    def take(self):
+        self.tokens -= 1
+
+    # stop sending anything for the given number of seconds
+    def pause(self, seconds):
+        self.tokens = min(self.tokens, 0) - seconds * self.rate
+        self.updated = time.monotonic()
+
+
+class RenderPipeline: # sends board frames to discord, skipping unchanged frames and merging frames while a channel is rate limited
+    def __init__(self):
+        self.global_bucket = RateBucket(global_edit_rate, global_edit_rate) # discord's limit for the whole bot
+        self.channel_buckets = {} # limit for editing messages in each channel, keyed by channel id
+        self.channel_intervals = {} # seconds between edits that each channel currently handles without slowing down, keyed by channel id
+
+    # seconds to wait before the next tick of a game, so that the game runs as fast as its channel can be edited
+    def tick_interval(self, session):
+        return self.channel_intervals.get(session.msg.channel.id, tick_interval)
+
+    # queue the latest frame of a game. Frames that arrive while an edit is waiting replace each other, so only the newest one is sent
+    def submit(self, session, description):
+        if description == session.last_frame and session.pending_frame is None:
+            return # board hasn't changed since the last edit
+        if session.pending_frame is not None:
+            metrics.count('tetris_frames_merged_total')
+        session.pending_frame = description
+        if session.frame_task is None or session.frame_task.done():
+            session.frame_task = asyncio.create_task(self.send_frames(session))
+
+    # wait for the frame that is being sent, and drop any frame that hasn't been sent yet
+    async def finish(self, session):
+        session.pending_frame = None
+        if session.frame_task is not None and not session.frame_task.done():
+            try:
+                await session.frame_task
+            except (asyncio.CancelledError, discord.HTTPException):
+                pass
+
+    # stop sending frames of a game
+    def cancel(self, session):
+        session.pending_frame = None
+        if session.frame_task is not None:
+            session.frame_task.cancel()
+
+    # edit the game message with the newest frame until there are no frames left
+    async def send_frames(self, session):
+        channel_id = session.msg.channel.id
+        bucket = self.channel_buckets.get(channel_id)
+        if bucket is None:
+            bucket = RateBucket(channel_edit_rate, channel_edit_burst)
+            self.channel_buckets[channel_id] = bucket
+        while session.pending_frame is not None and not session.stopped:
+            # wait until both the channel and the whole bot are allowed another edit
+            reserve = session.frame_reserve
+            delay = max(bucket.delay(reserve), self.global_bucket.delay(reserve))
+            while delay > 0:
+                await asyncio.sleep(delay)
+                delay = max(bucket.delay(reserve), self.global_bucket.delay(reserve))
+
+            frame = session.pending_frame
+            session.pending_frame = None
+            if frame is None or frame == session.last_frame:
+                continue # nothing new to show, so no request is used up
+            bucket.take()
+            self.global_bucket.take()
+            sent_at = time.monotonic()
+            try:
+                await timed_request('edit', session.msg.edit(embed=discord.Embed(description=frame, color=embed_colour)))
+            except discord.NotFound: # message was deleted
+                session.message_deleted()
+                return
+            except discord.Forbidden as error: # the bot may not edit the message anymore, e.g. it lost its permissions in the channel
+                logger.warning('Stopped, the message can\'t be edited: %r', error, extra=session.log.extra)
+                session.message_deleted()
+                return
+            except discord.HTTPException as error:
+                if error.status != 429: # e.g. a discord server error that discord.py already retried: send the newest frame later, and tick the channel slower meanwhile
+                    logger.warning('Edit failed: %r', error, extra=session.log.extra)
+                    self.slow_down(channel_id)
+                    if session.pending_frame is None:
+                        session.pending_frame = frame
+                    continue
+                # rate limited anyway: wait for as long as discord asks, then send the newest frame
+                headers = error.response.headers
+                retry_after = float(headers.get('Retry-After') or headers.get('X-RateLimit-Reset-After') or 1)
+                metrics.count('tetris_rate_limited_total')
+                logger.warning('Rate limited for %ss', retry_after, extra=session.log.extra)
+                if headers.get('X-RateLimit-Global'):
+                    self.global_bucket.pause(retry_after)
                 else:
-                    for c in range(no_of_cols):
-                        board2[r][c] = board[r - 1][c] # make the current square of the current row the same as the one above it
-            board = board2[:] # make the board variable equal to the modified board2 variable
-    # scoring system
-    if lines_to_clear == 1:
-        points += 100
-        lines += 1
-    elif lines_to_clear == 2:
-        points += 300
-        lines += 2
-    elif lines_to_clear == 3:
-        points += 500
-        lines += 3
-    elif lines_to_clear == 4:
-        points += 800
-        lines += 4
-
-# check if the next position for the current shape is available
-# takes in one argument, cur_shape_pos, which is the current position of the shape on the board
-def get_next_pos(cur_shape_pos):
-    global h_movement
-    global start_higher
-    global game_over
-
-    # initialize the amount of movement that the shape should move to
-    movement_amnt = 1
-
-    if down_pressed == False:
-        amnt_to_check = 1 # assign amnt_to_check variable as 1, which means that the function will check the space one below the current shape
-    else:
-        amnt_to_check = no_of_rows # amnt_to_check is assigned as no_of_rows, which means that the function will check all the rows until the furthest available space
-
-    for i in range(amnt_to_check):
-        square_no_in_shape = -1
-        for square in cur_shape_pos:
-            # check if the next position for the square is on the board and if the next position is empty
-            # if not empty, it checks if the shape can fit there. If not, it sets next_space_free as false, and if it is a new shape and start_higher is true, it sets game_over as true
-            next_space_free = True
-            square_no_in_shape += 1
-            square_row = square[0]
-            square_col = square[1]
-            if (0 <= square_col < no_of_cols): # if current column spot will fit
-                if not (0 <= square_col + h_movement < no_of_cols): # if spot with column position changed won't fit
-                    h_movement = 0
-                if (0 <= square_row + movement_amnt < no_of_rows): # if new square row pos is on board
-                    square_checking = board[square_row + movement_amnt][square_col + h_movement] # get the square to check if empty
-                    if (square_checking != empty_sq) and ([square_row + movement_amnt, square_col + h_movement] not in cur_shape_pos): # if square is not empty / won't be when other parts of the shape have moved
-                        # check if space is free if not moving horizontally, but is still going down
-                        h_movement = 0
-                        square_checking = board[square_row + movement_amnt][square_col + h_movement]
-                        if (square_checking != empty_sq) and ([square_row + movement_amnt, square_col + h_movement] not in cur_shape_pos):
-                            if movement_amnt == 1:
-                                next_space_free = False # can't put shape there
-                                print('Detected a space that isnt free')
-                                print('Square checking: ' + str(square_row + movement_amnt) + ', ' + str(square_col + h_movement))
-                                if is_new_shape: # if can't place new shape
-                                    if start_higher == True:
-                                        game_over = True
-                                    else:
-                                        start_higher = True
-                            elif movement_amnt > 1:
-                                movement_amnt -= 1 # accomodate for extra 1 added to check if it's free
-                            return [movement_amnt, next_space_free]
-                    elif down_pressed == True:
-                        if square_no_in_shape == 3: # only on last square in shape
-                            movement_amnt += 1 # increase amount to move shape by
-                elif square_row + movement_amnt >= no_of_rows:
-                    if movement_amnt == 1:
-                        next_space_free = False # can't put shape there
-                        print('Detected a space that isnt free')
-                    elif movement_amnt > 1: 
-                        movement_amnt -= 1 # accomodate for extra 1 added to check if it's free
-                    return [movement_amnt, next_space_free]
-                elif down_pressed == True:
-                    if square_no_in_shape == 3: # only on last square in shape
-                        movement_amnt += 1 # increase amount to move shape by
-
-    return [movement_amnt, next_space_free]
-
-
-async def run_game(msg, cur_shape):
-    global is_new_shape
-    global h_movement
-    global rotate_clockwise
-    global rotation_pos
-
-    cur_shape_pos = cur_shape[0] # assign the value of the first element of the cur_shape list to the variable cur_shape_pos
-    cur_shape_colour = cur_shape[1] # assign the value of the second element of the cur_shape list to the variable cur_shape_colour
-
-    # checks if the variable rotate_clockwise is equal to True and the variable cur_shape_colour is not equal to the variable yellow_sq
-    if rotate_clockwise == True and cur_shape_colour != yellow_sq:
-        cur_shape_pos = rotate_shape(cur_shape_pos, 'clockwise', cur_shape[2][rotation_pos], cur_shape_colour) # rotate shape
-        cur_shape = [cur_shape_pos, cur_shape_colour, cur_shape[2]] # update shape
-
-    next_pos = get_next_pos(cur_shape_pos)[:]
-    movement_amnt = next_pos[0]
-    next_space_free = next_pos[1]
-
-    # move/place shape if position is available
-    square_no_in_shape = -1
-    # if the next position for the shape is free (determined in the previous function get_next_pos), the code enters a loop that iterates through each square in the current shape's position
-    if next_space_free:
-        for square in cur_shape_pos:
-            square_no_in_shape += 1 # for each square, square_no_in_shape is incremented by 1, and the row and column of the square are stored in square_row and square_col respectively
-            square_row = square[0]
-            square_col = square[1]
-            if (0 <= square_row + movement_amnt < no_of_rows): # if new square row pos is on board
-                square_changing = board[square_row + movement_amnt][square_col + h_movement] # get square to change
-                board[square_row + movement_amnt][square_col + h_movement] = cur_shape_colour # changes square colour to colour of shape
-                if is_new_shape == True:
-                    is_new_shape = False # has been placed, so not new anymore
-                if square_row > -1: # stops from wrapping around list and changing colour of bottom rows
-                    board[square_row][square_col] = empty_sq # make old square empty again
-                cur_shape_pos[square_no_in_shape] = [square_row + movement_amnt, square_col + h_movement]
-            else: # if new square row position is not on the board
-                cur_shape_pos[square_no_in_shape] = [square_row + movement_amnt, square_col + h_movement]
-    else:
-        global down_pressed
-        down_pressed = False
-        clear_lines() # check for full lines and clear them
-        cur_shape = get_random_shape() # change shape
-        rotation_pos = 0 # reset rotation
-        print('Changed shape.')
-
-    if not game_over:
-        # update board
-        embed = discord.Embed(description=format_board_as_str(), color=embed_colour)
-        h_movement = 0 # reset horizontal movement
-        rotate_clockwise = False # reset clockwise rotation
-        await msg.edit(embed=embed)
-        if not is_new_shape:
-            await asyncio.sleep(1) # to keep under discord's API rate limit
-        await run_game(msg, cur_shape)
-    else:
-        print('GAME OVER')
-        desc = 'Score: {} \n Lines: {} \n \n Press ▶ to play again.'.format(points, lines)
-        embed = discord.Embed(title='GAME OVER', description=desc, color=embed_colour)
-        await msg.edit(embed=embed)
-        await msg.remove_reaction("⬅", client.user) # Left
-        await msg.remove_reaction("⬇", client.user) # Down
-        await msg.remove_reaction("➡", client.user) # Right
-        await msg.remove_reaction("🔃", client.user) # Rotate
-        await msg.add_reaction("▶") # Play
-
-# reset the game to its initial state
-async def reset_game():
-    global down_pressed
-    global rotate_clockwise
-    global rotation_pos
-    global h_movement
-    global is_new_shape
-    global start_higher
-    global game_over
-    global points
-    global lines
-    fill_board(empty_sq) # fill the game board with empty squares
-    down_pressed = False
-    rotate_clockwise = False
-    rotation_pos = 0
-    h_movement = 0
-    is_new_shape = False
-    start_higher = False
-    game_over = False
-    next_space_free = True
-    points = 0
-    lines = 0
-
-make_empty_board()
+                    bucket.pause(retry_after)
+                self.slow_down(channel_id)
+                if session.pending_frame is None:
+                    session.pending_frame = frame
+                continue
+            session.last_frame = frame
+            metrics.count('tetris_frames_sent_total')
+            self.observe(channel_id, time.monotonic() - sent_at)
+
+    # discord.py waits by itself when the rate limit headers say a bucket is used up, so a slow edit means the channel is being edited too often
+    def observe(self, channel_id, edit_time):
+        if edit_time > slow_edit_time:
+            metrics.count('tetris_slow_edits_total')
+            self.slow_down(channel_id)
+        else:
+            interval = self.channel_intervals.get(channel_id, tick_interval)
+            self.channel_intervals[channel_id] = max(min_tick_interval, interval - 0.05) # speed up a little at a time
+
+    # tick games in this channel less often
+    def slow_down(self, channel_id):
+        interval = self.channel_intervals.get(channel_id, tick_interval)
+        self.channel_intervals[channel_id] = min(max_tick_interval, interval * 2)
+
+    # forget the limits of channels that have no games or watchers left, so that they don't use up memory
+    # buckets that are still refilling are kept, so that a game started again right away can't go over the limit
+    def prune(self, live_channel_ids):
+        for channel_id, bucket in list(self.channel_buckets.items()):
+            if channel_id not in live_channel_ids and bucket.delay(bucket.capacity - 1) == 0:
+                del self.channel_buckets[channel_id]
+        for channel_id in list(self.channel_intervals):
+            if channel_id not in live_channel_ids and channel_id not in self.channel_buckets:
+                del self.channel_intervals[channel_id]
+
+
+# every running game, keyed by the id of the message that displays it
+sessions = {}
+spectators = {} # messages watching a game, keyed by the id of the game's message
+evicted_messages = LRUCache(max_evicted_messages) # messages of evicted games, keyed by message id
+unrestored_games = {} # games from the snapshot whose message couldn't be fetched yet, as [SavedGame, attempts], keyed by message id. They stay in the snapshot
+restored = False # set once the snapshot has been restored. Until then the snapshot isn't written, so that a bot that stops while starting up doesn't lose its games
+scheduler = TickScheduler() # runs the ticks of every game in sessions
+renderer = RenderPipeline() # sends the frames of every game in sessions
+metrics.gauge('tetris_active_sessions', 'Games that are registered to a message', lambda: len(sessions))
+metrics.gauge('tetris_spectators', 'Messages watching a game', lambda: sum(len(watchers) for watchers in spectators.values()))
+metrics.gauge('tetris_slowed_channels', 'Channels whose games tick slower than tick_interval', lambda: sum(1 for interval in renderer.channel_intervals.values() if interval > tick_interval))
+metrics_server = None # serves the metrics when METRICS_PORT is set
+store_task = None # writes finished games to the store
+
+# await a discord request and time it into request_seconds
+async def timed_request(name, request):
+    start = time.perf_counter()
+    try:
+        return await request
+    finally:
+        request_seconds.observe(name, time.perf_counter() - start)
+
+# create a game for a message and register it so reactions on that message reach it
+def create_session(msg, seed=None):
+    session = GameSession(msg, seed)
+    sessions[msg.id] = session
+    return session
+
+# stop a game and remove it from the registry
+# watchers are kept when the game is only being restarted
+def end_session(msg_id, restart=False):
+    session = sessions.pop(msg_id, None)
+    if session is not None:
+        scheduler.cancel(session)
+        renderer.cancel(session)
+    if not restart:
+        for spectator in spectators.pop(msg_id, []):
+            spectator.stopped = True
+            renderer.cancel(spectator)
+    return session
+
+# stop a message from watching its game
+def stop_watching(spectator):
+    spectator.stopped = True
+    renderer.cancel(spectator)
+    watchers = spectators.get(spectator.game_msg_id, [])
+    if spectator in watchers:
+        watchers.remove(spectator)
 
 
 #-------------------------------------------------------------------------------
 
 # sets up the bot
-client = commands.Bot(command_prefix = 't.',intents=discord.Intents().all()) # prefix set to 't.', all intents enabled
+# only the gateway events the bot uses are sent to it: messages for its commands and reactions for the controls. Presence and member updates never arrive
+intents = discord.Intents.none()
+intents.guilds = True # servers and their channels
+intents.guild_messages = True
+intents.dm_messages = True
+intents.message_content = True # needed to read the 't.' prefix
+intents.guild_reactions = True
+intents.dm_reactions = True
+
+# set SHARD_COUNT to split the bot's servers across that many shards, and SHARD_IDS (e.g. 0,1) to run only some of them in this process
+# supervisor.py starts a process for each group of shards and restarts the ones that die
+if shard_count:
+    client = commands.AutoShardedBot(command_prefix = 't.', intents=intents, shard_count=int(shard_count), shard_ids=shard_ids) # prefix set to 't.'
+else:
+    client = commands.Bot(command_prefix = 't.', intents=intents) # prefix set to 't.'
+
+# removes games that nobody has pressed a button on (and the autoplayer hasn't played) for session_timeout seconds, so that abandoned games don't use up memory
+@tasks.loop(minutes=1)
+async def evict_idle_sessions():
+    now = time.monotonic()
+    for msg_id, session in list(sessions.items()):
+        if now - session.last_active > session_timeout:
+            end_session(msg_id)
+            evicted_messages.put(msg_id, session.msg)
+            logger.info('Evicted idle game', extra=session.log.extra)
+    live_channel_ids = {session.msg.channel.id for session in sessions.values()}
+    live_channel_ids.update(spectator.msg.channel.id for watchers in spectators.values() for spectator in watchers)
+    renderer.prune(live_channel_ids)
+
+# save every running game to the snapshot file. Replays aren't saved, as they can be started again from the store
+def write_snapshot():
+    packed_games = []
+    for msg_id, session in sessions.items():
+        if not session.running() or isinstance(session.autoplayer, ReplayPlayer):
+            continue
+        player = session.player
+        packed_games.append(pack_game(session, msg_id, session.msg.channel.id, player.id if player is not None else 0,
+                                      player.display_name if player is not None else '', session.autoplayer is not None))
+    for saved, attempts in unrestored_games.values():
+        player = saved.player
+        packed_games.append(pack_game(saved.game, saved.msg_id, saved.channel_id, player.id if player is not None else 0,
+                                      player.display_name if player is not None else '', saved.autoplay))
+    snapshots.write(packed_games)
+
+@tasks.loop(seconds=snapshot_interval)
+async def save_snapshot():
+    if unrestored_games:
+        await restore_games([saved for saved, attempts in unrestored_games.values()])
+    write_snapshot()
+
+# start the games from the snapshot file again on their messages
+async def restore_sessions():
+    global restored
+    data = snapshots.read()
+    if data is not None:
+        saved_games = unpack_games(data, lambda seed: GameSession(None, seed))
+        restored_count = await restore_games(saved_games)
+        logger.info('Restored %s of %s games, %s to try again', restored_count, len(saved_games), len(unrestored_games))
+    restored = True
+
+# start saved games on their messages, and return how many were started. Games whose message is gone are dropped
+# games whose message couldn't be fetched for another reason, e.g. a discord server error, are kept in unrestored_games to be tried again
+async def restore_games(saved_games):
+    restored_count = 0
+    messages = await asyncio.gather(*[fetch_message(saved.channel_id, saved.msg_id) for saved in saved_games], return_exceptions=True)
+    for saved, msg in zip(saved_games, messages):
+        attempts = unrestored_games.pop(saved.msg_id, [saved, 0])[1] + 1
+        if isinstance(msg, (discord.NotFound, discord.Forbidden)):
+            logger.info('Dropped saved game, its message is gone: %r', msg, extra={'game': saved.msg_id})
+            continue
+        if isinstance(msg, BaseException):
+            if attempts < max_restore_attempts:
+                unrestored_games[saved.msg_id] = [saved, attempts]
+                logger.warning('Could not restore game, will try again: %r', msg, extra={'game': saved.msg_id})
+            else:
+                logger.warning('Dropped saved game after %s attempts: %r', attempts, msg, extra={'game': saved.msg_id})
+            continue
+        if msg.id in sessions: # a new game was started on the message meanwhile
+            continue
+        session = saved.game
+        if saved.autoplay:
+            try:
+                from autoplayer import AutoPlayer
+            except ImportError: # numpy isn't installed anymore
+                continue
+            session.autoplayer = AutoPlayer()
+        session.attach(msg)
+        session.player = saved.player
+        sessions[msg.id] = session
+        scheduler.add(session)
+        restored_count += 1
+    return restored_count
+
+# get a message from discord, also when it isn't in discord.py's message cache
+async def fetch_message(channel_id, msg_id):
+    channel = client.get_channel(channel_id) or await client.fetch_channel(channel_id)
+    return await channel.fetch_message(msg_id)
 
 # triggers if bot logs in
 @client.event
 async def on_ready():
-    print("logged in :D")
+    logger.info('Logged in as %s', client.user)
+    # everything else is started first, so that a slow or failing restore of the snapshot can't hold it up
+    if not evict_idle_sessions.is_running():
+        evict_idle_sessions.start()
+    if control_mode == 'buttons':
+        client.add_view(GameButtons()) # handle presses on game messages from before the bot restarted
+    global store_task
+    if store_task is None:
+        store_task = asyncio.create_task(store.run())
+    global metrics_server
+    if metrics_port and metrics_server is None:
+        metrics_server = await serve_metrics(metrics, '127.0.0.1', int(metrics_port))
+        logger.info('Serving metrics on port %s', metrics_port)
+    if not save_snapshot.is_running():
+        try:
+            await restore_sessions()
+        except Exception: # the snapshot is left as it is, and isn't written while this process runs, so its games can still be restored by the next one
+            logger.exception('Could not restore the snapshot')
+            return
+        save_snapshot.start()
+
+# triggers when one shard of a sharded bot has connected
+@client.event
+async def on_shard_ready(shard_id):
+    logger.info('Shard %s of %s ready', shard_id, shard_count)
 
 @client.command()
-async def start(ctx): # create an initial game board and sends an embed message with the game board and instructions on how to play. It also adds the "▶" reaction to the message, which allows the user to start the game
-    await reset_game()
-    embed = discord.Embed(title='Tiny Tetris Bot', description=format_board_as_str(), color=embed_colour)
+async def start(ctx): # create an initial game board and sends an embed message with the game board and instructions on how to play. The controls are added to the message once, and ▶ starts the game
+    embed = discord.Embed(title='Tiny Tetris Bot', description=GameSession(None).format_board_as_str(), color=embed_colour)
     embed.add_field(name='How to Play:', value='Use ⬅ ⬇ ➡ to move left, down, and right respectively. \n  \n Use 🔃 to rotate the shape clockwise. \n \n Press ▶ to Play.', inline=False)
 
-    msg = await ctx.send(embed=embed)
+    msg = await send_game_message(ctx, embed, controls)
+    create_session(msg)
+
+@client.command()
+async def auto(ctx): # starts a game that the bot plays by itself, which is useful for demos and for testing how fast games can be shown
+    try:
+        from autoplayer import AutoPlayer
+    except ImportError: # numpy isn't installed
+        await ctx.send('The autoplayer needs numpy, install it with: pip install numpy')
+        return
+    embed = discord.Embed(title='Tiny Tetris Bot', description=GameSession(None).format_board_as_str(), color=embed_colour)
+    embed.add_field(name='Autoplay:', value='The bot is playing by itself. \n \n Press ❌ to stop.', inline=False)
+    msg = await send_game_message(ctx, embed, ["❌"]) # Stop Game
+    session = create_session(msg)
+    session.last_frame = embed.description
+    session.autoplayer = AutoPlayer()
+    session.get_random_shape()
+    scheduler.add(session)
 
-    # add button choices / reactions
-    await msg.add_reaction("▶") # Play
+@client.command()
+async def top(ctx): # shows the best games played in this server
+    rows = await store.top(ctx.guild.id if ctx.guild is not None else 0)
+    lines = ['{}. {} - {} points, {} lines (replay {})'.format(rank, user_name, points, lines, game_id) for rank, (game_id, user_name, points, lines) in enumerate(rows, 1)]
+    embed = discord.Embed(title='Leaderboard', description='\n'.join(lines) or 'No games finished yet. Send t.start to play!', color=embed_colour)
+    await ctx.send(embed=embed)
+
+@client.command()
+async def replay(ctx, game_id: int = None): # plays a finished game again from its seed and inputs. Without an id, plays the last game of whoever sent the command
+    if game_id is None:
+        game_id = await store.latest(ctx.author.id, ctx.guild.id if ctx.guild is not None else 0)
+    saved = await store.replay(game_id) if game_id is not None else None
+    if saved is None:
+        await ctx.send('There is no saved game with that id.')
+        return
+    seed, input_log = saved
+    embed = discord.Embed(title='Tiny Tetris Bot', description=GameSession(None).format_board_as_str(), color=embed_colour)
+    embed.add_field(name='Replay:', value='Replaying game {}. \n \n Press ❌ to stop.'.format(game_id), inline=False)
+    msg = await send_game_message(ctx, embed, ["❌"]) # Stop Game
+    session = create_session(msg, seed)
+    session.last_frame = embed.description
+    session.autoplayer = ReplayPlayer(input_log)
+    session.get_random_shape()
+    scheduler.add(session)
+
+@client.command()
+async def watch(ctx, game: str): # shows a running game in this channel as well. Takes the link or id of the game's message
+    try:
+        game_msg_id = int(game.rstrip('/').split('/')[-1])
+    except ValueError:
+        game_msg_id = None
+    session = sessions.get(game_msg_id)
+    if session is None:
+        await ctx.send('There is no game running on that message.')
+        return
+    watchers = spectators.setdefault(game_msg_id, [])
+    if len(watchers) >= max_spectators:
+        await ctx.send('That game already has {} watchers.'.format(max_spectators))
+        return
+    embed = discord.Embed(description=session.format_board_as_str(), color=embed_colour)
+    spectator = Spectator(await ctx.send(embed=embed), game_msg_id)
+    spectator.last_frame = embed.description
+    watchers.append(spectator)
+    logger.info('Watched from channel %s', ctx.channel.id, extra=spectator.log.extra)
+
+@client.command()
+async def stats(ctx): # shows how busy the bot is and how long ticks and discord requests take
+    uptime = metrics.uptime()
+    counters = {name: value for name, (description, value) in metrics.counters.items()}
+    desc = 'Games: {} \n Ticks/sec: {:.1f} \n Frames sent: {} ({} merged) \n Rate limited: {} times'.format(
+        len(sessions), counters['tetris_ticks_total'] / uptime, counters['tetris_frames_sent_total'], counters['tetris_frames_merged_total'], counters['tetris_rate_limited_total'])
+    if shard_count:
+        games_per_shard = {shard_id: 0 for shard_id in client.shards}
+        for session in sessions.values():
+            games_per_shard[session.shard_id] = games_per_shard.get(session.shard_id, 0) + 1
+        desc += ' \n Games per shard: ' + ', '.join('{}: {}'.format(shard_id, games) for shard_id, games in sorted(games_per_shard.items()))
+    embed = discord.Embed(title='Tiny Tetris Bot Stats', description=desc, color=embed_colour)
+    # 50th and 95th percentile of every timed phase and request, as bucket upper bounds in milliseconds
+    for family in (phase_seconds, request_seconds):
+        lines = ['{}: {:g} / {:g} ms ({})'.format(name, histogram.quantile(0.5) * 1000, histogram.quantile(0.95) * 1000, histogram.count) for name, histogram in family.histograms.items()]
+        embed.add_field(name=family.description + ' (p50 / p95):', value='\n'.join(lines) or 'Nothing yet', inline=False)
+    await ctx.send(embed=embed)
+
+@client.command()
+@commands.is_owner()
+async def profile(ctx): # turns the sampling profiler on, or off again and writes a flame graph file for every game that ran meanwhile
+    if not profiler.running():
+        profiler.start()
+        await ctx.send('Profiling started, send t.profile again to stop.')
+    else:
+        paths = await asyncio.to_thread(profiler.stop, profile_dir)
+        await ctx.send('Wrote {} flame graph files to {}'.format(len(paths), profile_dir))
+
+# send a new game message with its controls, which are only ever added once. Returns the message
+async def send_game_message(ctx, embed, emojis):
+    if control_mode == 'buttons':
+        return await ctx.send(embed=embed, view=GameButtons())
+    msg = await ctx.send(embed=embed)
+    # add the reactions in the background, so that the game can start while they are being added
+    task = asyncio.create_task(add_reactions(msg, emojis))
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return msg
+
+background_tasks = set() # keeps running background coroutines from being garbage collected
+
+# add reactions to a message one after another, in order, so that they show up in that order
+async def add_reactions(msg, emojis):
+    try:
+        for emoji in emojis:
+            await timed_request('add_reaction', msg.add_reaction(emoji))
+    except discord.HTTPException as error: # message was deleted, or the bot may not add reactions
+        logger.warning('Could not add reactions: %r', error)
+
+# performs the action of a control that a user pressed on a game message, such as start, move left, right, down, rotate, or delete the game board
+# user is only needed for ▶, and may be None for the other controls
+async def handle_press(msg, emoji, user):
+    session = sessions.get(msg.id)
+    if session is None:
+        if emoji != "▶": # not a game message, or its game was evicted
+            return
+        session = create_session(msg) # restart an evicted game
+    session.touch()
+    logger.debug('%s pressed %s', user, emoji, extra=session.log.extra)
+    if session.autoplayer is not None and emoji != "❌":
+        return # the bot is playing this game, only stopping it is allowed
+
+    if emoji == "▶": # Play button pressed
+        if session.running():
+            return # game is already running
+        end_session(msg.id, restart=True) # stop the previous run of this game, if there is one
+        session = create_session(msg)
+        session.player = user
+        logger.info('Started game with seed %s', session.seed, extra=session.log.extra)
+        session.get_random_shape()
+        scheduler.add(session) # the first tick sends the board
+    elif emoji == "⬅": # Left button pressed
+        session.push_input(left) # move 1 left
+    elif emoji == "➡": # Right button pressed
+        session.push_input(right) # move 1 right
+    elif emoji == "⬇": # Down button pressed
+        session.push_input(down) # drop
+    elif emoji == "🔃": # Rotate button pressed
+        session.push_input(rotate)
+    elif emoji == "❌": # Stop game button pressed
+        end_session(msg.id)
+        await msg.delete()
+    elif emoji == "🔴":
+        await timed_request('edit', msg.edit(content=""))
+
+# finds the message and user of a raw reaction event, then handles the press
+# raw events also arrive for messages that aren't in discord.py's message cache, such as game messages sent before the bot restarted
+# a press never waits for a request to discord, except ▶ starting a game whose player isn't cached
+async def handle_reaction(payload):
+    if payload.user_id == client.user.id:
+        return
+    emoji = str(payload.emoji)
+    session = sessions.get(payload.message_id)
+    if session is not None:
+        msg = session.msg
+    elif emoji == "▶": # may be a game message whose game was evicted
+        msg = evicted_messages.get(payload.message_id)
+        if msg is None:
+            return
+    else:
+        return
+    user = payload.member or client.get_user(payload.user_id) # None on removed reactions when the member isn't cached
+    if user is None and emoji == "▶" and (session is None or not session.running() and session.autoplayer is None):
+        user = await client.fetch_user(payload.user_id) # becomes the player of the new game
+    await handle_press(msg, emoji, user)
 
 @client.event
 # triggered whenever a user adds a reaction to a message
-# checks the reaction emoji and performs the corresponding action such as move left, right, down, rotate, stop the game or delete the game board
-async def on_reaction_add(reaction, user):
-    global h_movement
-    global rotation_pos
-    if user != client.user:
-        msg = reaction.message
-        if str(reaction.emoji) == "▶": # Play button pressed
-            print('User pressed play')
-            await reset_game()
-            await msg.remove_reaction("❌", client.user) # remove Delete
-            embed = discord.Embed(description=format_board_as_str(), color=embed_colour)
-            await msg.remove_reaction("▶", user)
-            await msg.remove_reaction("▶", client.user)
-            await msg.edit(embed=embed)
-            await msg.add_reaction("⬅") # Left
-            await msg.add_reaction("⬇") # Down
-            await msg.add_reaction("➡") # Right
-            await msg.add_reaction("🔃") # Rotate
-            await msg.add_reaction("❌") # Stop Game
-            starting_shape = get_random_shape()
-            await run_game(msg, starting_shape)
-
-        if str(reaction.emoji) == "⬅": # Left button pressed
-            print('Left button pressed')
-            h_movement = -1 # move 1 left
-            await msg.remove_reaction("⬅", user)
-        if str(reaction.emoji) == "➡": # Right button pressed
-            print('Right button pressed')
-            h_movement = 1 # move 1 right
-            await msg.remove_reaction("➡", user)
-        if str(reaction.emoji) == "⬇": # Down button pressed
-            print('Down button pressed')
-            global down_pressed
-            down_pressed = True
-            await msg.remove_reaction("⬇", user)
-        if str(reaction.emoji) == "🔃": # Rotate button pressed
-            print('Rotate clockwise button pressed')
-            global rotate_clockwise
-            rotate_clockwise = True
-            if rotation_pos < 3:
-                rotation_pos += 1
-            else:
-                rotation_pos = 0 # go back to original position
-            await msg.remove_reaction("🔃", user)
-        if str(reaction.emoji) == "❌": # Stop game button pressed
-            await reset_game()
-            await msg.delete()
-        if str(reaction.emoji) == "🔴":
-            await msg.edit(content="")
-
+# the bot doesn't remove the reaction again, so that a press costs no requests. Taking the reaction back off is the next press
+async def on_raw_reaction_add(payload):
+    await handle_reaction(payload)
 
-client.run(TOKEN)
+@client.event
+# triggered whenever a user removes their reaction from a message, which counts as pressing that control again
+async def on_raw_reaction_remove(payload):
+    if str(payload.emoji) != "❌":
+        await handle_reaction(payload)
+
+
+class GameButtons(discord.ui.View): # message buttons for controlling a game, used when control_mode is 'buttons'
+    def __init__(self):
+        discord.ui.View.__init__(self, timeout=None) # buttons keep working, also on messages sent before a restart once the view is added in on_ready
+
+    # answer the interaction without changing the message, then handle the press. The board is updated by the game's next frame
+    async def press(self, interaction, emoji):
+        await interaction.response.defer()
+        await handle_press(interaction.message, emoji, interaction.user)
+
+    @discord.ui.button(emoji="⬅", custom_id="ttb:left", row=0)
+    async def left_button(self, interaction, button):
+        await self.press(interaction, "⬅")
+
+    @discord.ui.button(emoji="⬇", custom_id="ttb:down", row=0)
+    async def down_button(self, interaction, button):
+        await self.press(interaction, "⬇")
+
+    @discord.ui.button(emoji="➡", custom_id="ttb:right", row=0)
+    async def right_button(self, interaction, button):
+        await self.press(interaction, "➡")
+
+    @discord.ui.button(emoji="🔃", custom_id="ttb:rotate", row=0)
+    async def rotate_button(self, interaction, button):
+        await self.press(interaction, "🔃")
+
+    @discord.ui.button(emoji="▶", custom_id="ttb:play", style=discord.ButtonStyle.success, row=1)
+    async def play_button(self, interaction, button):
+        await self.press(interaction, "▶")
+
+    @discord.ui.button(emoji="❌", custom_id="ttb:stop", style=discord.ButtonStyle.danger, row=1)
+    async def stop_button(self, interaction, button):
+        await self.press(interaction, "❌")
+
+signal.signal(signal.SIGTERM, signal.default_int_handler) # stopping the process, e.g. by the supervisor, shuts the bot down like Ctrl+C does
+client.run(TOKEN, log_handler=None) # discord.py logs through the handlers set up above
+if restored: # otherwise the snapshot still holds the games from before this run
+    write_snapshot() # save the running games, so that they go on after the restart
+snapshots.close()
+store.close() # write the games that finished since the last batch
+log_listener.stop() # write out the records that are still queued